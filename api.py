@@ -0,0 +1,78 @@
+"""Helpers for the JSON API under /api/v1.
+
+Responses are built straight from query result rows (plain tuples) rather
+than ORM objects, and encoded with orjson when it is installed.
+"""
+import json
+from datetime import date, datetime
+
+from flask import Response, abort, request
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, separators=(',', ':')).encode()
+
+
+def json_response(data, status=200):
+    return Response(dumps(data), status=status, mimetype='application/json')
+
+
+def error(message, status=400):
+    """Abort the request with a JSON {"error": message} body."""
+    abort(json_response({'error': message}, status=status))
+
+
+def int_arg(name, default=None):
+    """Integer query string argument `name`; a value that is not one is a 400."""
+    value = request.args.get(name, '')
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        error('{} must be an integer.'.format(name))
+
+
+def requested_fields(available, default=None):
+    """Columns named by ?fields=a,b (in that order), or `default` / all of them."""
+    fields = request.args.get('fields')
+    if not fields:
+        return list(default or available)
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        error('Unknown fields: ' + ', '.join(unknown))
+    if 'id' not in fields:
+        # Keyset pagination needs the id of the last row.
+        fields.insert(0, 'id')
+    return fields
+
+
+def page_args():
+    """(after, limit) from the query string for keyset pagination by id."""
+    after = int_arg('after')
+    limit = int_arg('limit', DEFAULT_PAGE_SIZE)
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def page_response(rows, fields, limit):
+    # `rows` holds up to limit + 1 rows; the extra one only signals a next page.
+    data = [dict(zip(fields, row)) for row in rows[:limit]]
+    next_after = data[-1]['id'] if len(rows) > limit else None
+    return json_response({'data': data, 'next': next_after})
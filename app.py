@@ -3,17 +3,35 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-from datetime import datetime
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+import base64
+import functools
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from jinja2 import FileSystemBytecodeCache
+from flask import Flask, Blueprint, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context, get_flashed_messages, has_app_context, session, current_app, g
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.exc import IntegrityError
+from werkzeug.local import LocalProxy
+import click
+import api
+import asyncdb
+import booking
+import bulk
+import cache
+import dates
+import ical
+import instrumentation
+from instrumentation import query_budget
+import routing
+import search
+import suggest
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import FlaskForm
 from forms import *
+from models import db, Venue, Artist, Show, ShowFeed, GenreCount, GENRE_KINDS, adjust_show_counts, show_count_deltas, genre_criterion, index_genres, refresh_show_feed, rollover_shows
 import os
 import sys
 
@@ -21,243 +39,355 @@ import sys
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate (app, db)
+# Extensions are created unbound and attached to an application in
+# create_app(), so importing this module touches neither the configuration
+# nor the database.
+moment = Moment()
+page_cache = cache.ResponseCache(vary=dates.request_variant)
+request_metrics = instrumentation.Instrumentation()
+async_db = asyncdb.AsyncDatabase(db)
+
+main = Blueprint('main', __name__, cli_group=None)
 
 #----------------------------------------------------------------------------#
-# Models.
+# Filters.
 #----------------------------------------------------------------------------#
 
-class Venue(db.Model):
-    __tablename__ = 'venues'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    genres = db.Column(db.ARRAY(db.String))
-    address = db.Column(db.String(120))
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    website_link = db.Column(db.String(120))
-    facebook_link = db.Column(db.String(120))
-    seeking_talent = db.Column(db.Boolean)
-    seeking_description = db.Column(db.String(150))
-    image_link = db.Column(db.String(500))
-    past_shows_count = db.Column(db.Integer, default=0)
-    upcoming_shows_count = db.Column(db.Integer, default=0)
-    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete')
-
-    def toDict(self):
-       return dict(id=self.id, name=self.name)
-
-class Artist(db.Model):
-    __tablename__ = 'artists'
-
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
-    genres = db.Column(db.ARRAY(db.String))
-    city = db.Column(db.String(120))
-    state = db.Column(db.String(120))
-    phone = db.Column(db.String(120))
-    website_link = db.Column(db.String(120))
-    facebook_link = db.Column(db.String(120))
-    seeking_venue = db.Column(db.Boolean)
-    seeking_description = db.Column(db.String(150))
-    image_link = db.Column(db.String(500))
-    past_shows_count = db.Column(db.Integer, default=0)
-    upcoming_shows_count = db.Column(db.Integer, default=0)
-    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete')
-    
-    def toDict(self):
-       return dict(id=self.id, name=self.name)
-
-class Show(db.Model):
-    __tablename__ = 'shows'
-
-    id = db.Column(db.Integer, primary_key=True)
-    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'))
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'))
-    start_time = db.Column(db.DateTime, nullable=False)
-
-    def toDict(self):
-       return dict(id=self.id, artist_id=self.artist_id, venue_id=self.venue_id)
-
-db.create_all()
-db.session.commit()
+# Dates are formatted in the request's locale and time zone (see dates.py).
+format_datetime = dates.format_datetime
+
+def stream_template(template_name, **context):
+  # Flashes are popped from the session while the body is being generated,
+  # i.e. after the session cookie has gone out; consume them up front.
+  get_flashed_messages()
+  current_app.update_template_context(context)
+  template = current_app.jinja_env.get_template(template_name)
+  return Response(stream_with_context(template.stream(context)))
 
 #----------------------------------------------------------------------------#
-# Filters.
+# Page cache.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  if isinstance(value, str):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  else:
-    date = value
-  return babel.dates.format_datetime(date, format, locale='en')
+def venue_page_keys(venue_id):
+  # A venue's page plus the pages of every artist listing a show there.
+  artist_ids = db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()
+  return ['venue:%s' % venue_id] + ['artist:%s' % artist_id for artist_id, in artist_ids]
 
-app.jinja_env.filters['datetime'] = format_datetime
+def artist_page_keys(artist_id):
+  # An artist's page plus the pages of every venue listing a show by them.
+  venue_ids = db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()
+  return ['artist:%s' % artist_id] + ['venue:%s' % venue_id for venue_id, in venue_ids]
+
+#----------------------------------------------------------------------------#
+# Conditional requests.
+#----------------------------------------------------------------------------#
+
+def conditional(validator):
+  # validator(**view_args) returns the row versions a page is rendered from
+  # and when they last changed, or None to skip validation. Matching
+  # If-None-Match / If-Modified-Since requests are answered with a 304
+  # before the view runs.
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+      if session.get('_flashes'):
+        return view(**kwargs)
+      state = validator(**kwargs)
+      if state is None:
+        return view(**kwargs)
+      parts, last_modified = state
+      # The page cache only serves bodies rendered from this same state.
+      g.page_state = hashlib.sha1(repr(parts).encode()).hexdigest()
+      etag = hashlib.sha1(repr((parts, request.query_string, dates.request_variant())).encode()).hexdigest()
+
+      if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+      else:
+        not_modified = bool(request.if_modified_since and last_modified
+          and last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None))
+      if not_modified:
+        response = Response(status=304)
+      else:
+        response = current_app.make_response(view(**kwargs))
+        if response.status_code != 200:
+          return response
+      response.set_etag(etag)
+      if last_modified:
+        response.last_modified = last_modified
+      response.cache_control.no_cache = True
+      response.vary.add('Accept-Language')
+      return response
+    return wrapper
+  return decorator
+
+def venues_state():
+  # The listing shows the maintained upcoming show counters, so their sum
+  # covers new, deleted and rolled-over shows.
+  venue_state = db.session.query(
+    db.func.count(Venue.id),
+    db.func.max(Venue.updated_at),
+    db.func.sum(Venue.upcoming_shows_count)
+  ).one()
+  return tuple(venue_state), venue_state[1]
+
+def artists_state():
+  artist_state = db.session.query(db.func.count(Artist.id), db.func.max(Artist.updated_at)).one()
+  return tuple(artist_state), artist_state[1]
+
+def entity_state(model, foreign_key, other, other_key, entity_id):
+  # The entity's whole row comes along with its state, and is kept in
+  # g.page_entity so that the page does not load it again.
+  now = datetime.now()
+  row = db.session.execute(db.select(
+    model.__table__,
+    db.func.count(Show.id).label('state_shows'),
+    db.func.count(db.case((Show.start_time < now, Show.id))).label('state_past_shows'),
+    db.func.max(Show.updated_at).label('state_shows_updated_at'),
+    db.func.max(other.updated_at).label('state_others_updated_at')
+  ).outerjoin(Show, foreign_key == model.id) \
+    .outerjoin(other, other_key == other.id) \
+    .where(model.id == entity_id) \
+    .group_by(model.id)).one_or_none()
+  if row is None:
+    abort(404)
+  g.page_entity = row
+  parts = (row.version, row.updated_at, row.state_shows, row.state_past_shows,
+    row.state_shows_updated_at, row.state_others_updated_at)
+  return parts, max_datetime(row.updated_at, row.state_shows_updated_at, row.state_others_updated_at)
+
+def venue_state(venue_id):
+  return entity_state(Venue, Show.venue_id, Artist, Show.artist_id, venue_id)
+
+def artist_state(artist_id):
+  return entity_state(Artist, Show.artist_id, Venue, Show.venue_id, artist_id)
+
+def page_entity(model, entity_id, *statements):
+  # The row entity_state() loaded, or the entity fetched along with
+  # `statements` when the page was not validated (e.g. it has flashes).
+  # Returns the row and the results of `statements`.
+  entity = g.get('page_entity')
+  if entity is not None:
+    return (entity, *async_db.fetch(*statements))
+  rows, *results = async_db.fetch(db.select(model.__table__).where(model.id == entity_id), *statements)
+  if not rows:
+    abort(404)
+  return (rows[0], *results)
+
+def max_datetime(*values):
+  values = [value for value in values if value is not None]
+  return max(values) if values else None
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+# The area the visitor last filtered /shows by, as "state|city".
+AREA_COOKIE = 'area'
+
+@main.route('/')
+@query_budget(2)
 def index():
-  return render_template('pages/home.html')
+
+  # Upcoming shows in the visitor's area, or anywhere if there are none.
+  state, _, city = request.cookies.get(AREA_COOKIE, '').partition('|')
+  limit = current_app.config['HOME_UPCOMING_SHOWS']
+  now = datetime.now()
+  area_filters = {name: value for name, value in (('state', state), ('city', city)) if value}
+  upcoming_shows = []
+  if area_filters:
+    upcoming_shows, = async_db.fetch(show_listing_query(start=now, **area_filters).limit(limit).statement)
+  if not upcoming_shows:
+    area_filters = {}
+    upcoming_shows, = async_db.fetch(show_listing_query(start=now).limit(limit).statement)
+
+  area = ', '.join(value for value in (city, state) if value) if area_filters else None
+  return render_template('pages/home.html', upcoming_shows=upcoming_shows, area=area,
+    area_filters=dict(area_filters, **{'from': now.date().isoformat()}))
 
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
-def venues():
-
-  data = []
-  venues = Venue.query.all()
+def encode_venue_cursor(state, city, venue_id):
+  raw = json.dumps([state, city, venue_id])
+  return base64.urlsafe_b64encode(raw.encode()).decode()
 
-  for venue in venues:
-    data.append({
-      "city": venue.city, 
-      "state": venue.state, 
-      "venues": [{
-        "id": venue.id, 
-        "name": venue.name, 
-        "num_upcoming_shows": venue.upcoming_shows_count
-      }]
+def decode_venue_cursor(cursor):
+  try:
+    state, city, venue_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    return str(state), str(city), int(venue_id)
+  except (ValueError, TypeError, UnicodeDecodeError):
+    abort(400)
+
+def venue_area_aggregate(page, dialect_name):
+  # The venues of one area of `page` as a JSON list, with their maintained
+  # upcoming show counts.
+  fields = ('id', page.c.id, 'name', page.c.name,
+    'num_upcoming_shows', db.func.coalesce(page.c.upcoming_shows_count, 0))
+  if dialect_name == 'postgresql':
+    return db.func.json_agg(aggregate_order_by(db.func.json_build_object(*fields), page.c.id))
+  return db.func.json_group_array(db.func.json_object(*fields))
+
+def venue_areas(rows):
+  # One row per (city, state), in listing order. SQLite does not promise
+  # the order of json_group_array, so each area's venues are put back in
+  # id order, the order the cursor pages by.
+  areas = []
+  for row in rows:
+    venues = json.loads(row.venues) if isinstance(row.venues, str) else row.venues
+    areas.append({
+      "city": row.city,
+      "state": row.state,
+      "venues": sorted(venues, key=lambda venue: venue['id'])
     })
+  return areas
+
+def genre_filters():
+  # ?genre= (repeatable) with ?match=all for venues or artists tagged with
+  # every genre given; any of them by default.
+  genres = []
+  for value in request.args.getlist('genre'):
+    genre = next((known for known in GENRES if known.lower() == value.lower()), None)
+    if genre is None:
+      abort(400)
+    genres.append(genre)
+  return genres, request.args.get('match') == 'all'
+
+def genre_filter_query(model, statement):
+  # `statement` narrowed to the requested genres, plus the facet counts
+  # for the sidebar.
+  genres, match_all = genre_filters()
+  if genres:
+    statement = statement.where(genre_criterion(model, genres, match_all, db.session.connection().dialect.name))
+  facets = db.select(GenreCount.genre, GenreCount.count) \
+    .where(GenreCount.kind == GENRE_KINDS[model], GenreCount.count > 0) \
+    .order_by(GenreCount.genre)
+  filter_args = {'genre': genres, 'match': 'all'} if match_all else {'genre': genres}
+  return statement, facets, {'selected': genres, 'match_all': match_all, 'args': filter_args if genres else {}}
+
+@main.route('/venues')
+@query_budget(3)
+@conditional(venues_state)
+@page_cache.cached('venues')
+def venues():
 
-  return render_template('pages/venues.html', areas=data);
-
-@app.route('/venues/search', methods=['POST'])
-def search_venues():
-
-  ven_search = Venue.query.filter(Venue.name.ilike('%' + request.form.get('search_term', '') + '%')).all()
+  per_page = current_app.config['VENUES_PER_PAGE']
+
+  # The page's venues come from an index range scan in (state, city, id)
+  # order from the cursor, and are then grouped by area in the database.
+  # A page holds a bounded number of venues however large any one area is;
+  # an area cut off at the end of a page carries on at the top of the next.
+  page = db.select(Venue.id, Venue.name, Venue.city, Venue.state, Venue.upcoming_shows_count) \
+    .order_by(Venue.state, Venue.city, Venue.id).limit(per_page + 1)
+  after = request.args.get('after')
+  if after:
+    page = page.where(db.tuple_(Venue.state, Venue.city, Venue.id) > decode_venue_cursor(after))
+  page, facets, genre_filter = genre_filter_query(Venue, page)
+  page = page.subquery('page')
+  statement = db.select(
+    page.c.city,
+    page.c.state,
+    venue_area_aggregate(page, db.session.connection().dialect.name).label('venues')
+  ).group_by(page.c.state, page.c.city).order_by(page.c.state, page.c.city)
+  rows, facets = async_db.fetch(statement, facets)
+
+  areas = venue_areas(rows)
+  next_cursor = None
+  if sum(len(area['venues']) for area in areas) > per_page:
+    # The extra venue fetched only tells that there is another page.
+    areas[-1]['venues'].pop()
+    if not areas[-1]['venues']:
+      areas.pop()
+    last = areas[-1]
+    next_cursor = encode_venue_cursor(last['state'], last['city'], last['venues'][-1]['id'])
+
+  return stream_template('pages/venues.html', areas=areas,
+    next_cursor=next_cursor, facets=facets, genre_filter=genre_filter)
+
+GENRES = [value for value, label in VenueForm.genres.kwargs['choices']]
+STATES = [value for value, label in VenueForm.state.kwargs['choices']]
+
+def search_page(model):
+  search_term = request.values.get('search_term', '')
+  page = max(1, request.values.get('page', 1, type=int))
+  per_page = current_app.config['SEARCH_RESULTS_PER_PAGE']
+
+  statement = search.search_statement(
+    model, search_term, db.session.connection().dialect.name,
+    genres=search.matching_genres(search_term, GENRES),
+    limit=per_page, offset=(page - 1) * per_page
+  )
+  rows, = async_db.fetch(statement) if statement is not None else ([],)
+  count = rows[0].total if rows else 0
   response={
-    "count": len(ven_search),
-    "data": ven_search
-  } 
+    "count": count,
+    "data": rows,
+    "page": page,
+    "prev_page": page - 1 if page > 1 else None,
+    "next_page": page + 1 if page * per_page < count else None
+  }
+  return response, search_term
+
+@main.route('/venues/search', methods=['GET', 'POST'])
+@query_budget(1)
+@routing.read_only
+def search_venues():
 
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  response, search_term = search_page(Venue)
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
-@app.route('/venues/<int:venue_id>')
+@main.route('/venues/<int:venue_id>')
+@query_budget(2)
+@conditional(venue_state)
+@page_cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
 
-  ven = Venue.query.get(venue_id)
-  show = Show.query.join(Artist).filter(Show.venue_id == ven.id).first()
-  art = Artist.query.join(Show).filter(Artist.id==Show.artist_id).first()
-
-  if ven.past_shows_count > 0 and ven.upcoming_shows_count > 0:
-    data={
-      'id': ven.id,
-      'name': ven.name,
-      'genres': ven.genres,
-      'city': ven.city,
-      'state': ven.state,
-      'address': ven.address,
-      'phone': ven.phone,
-      'website': ven.website_link,
-      'facebook_link': ven.facebook_link,
-      'image_link': ven.image_link,
-      'seeking_talent': ven.seeking_talent,
-      'seeking_description': ven.seeking_description,
-      'past_shows_count': ven.past_shows_count,
-      'upcoming_shows_count': ven.upcoming_shows_count,
-      "past_shows": [{
-        "artist_id": show.artist_id,
-        "artist_name": art.name,
-        "artist_image_link": art.image_link,
-        "start_time": show.start_time
-      }],
-      "upcoming_shows": [{
-        "artist_id":show.artist_id,
-        "artist_name": art.name,
-        "artist_image_link": art.image_link,
-        "start_time": show.start_time
-      }]
-      }
-  elif ven.past_shows_count == 0 and ven.upcoming_shows_count > 0:
-    data={
-      'id': ven.id,
-      'name': ven.name,
-      'genres': ven.genres,
-      'city': ven.city,
-      'state': ven.state,
-      'address': ven.address,
-      'phone': ven.phone,
-      'website': ven.website_link,
-      'facebook_link': ven.facebook_link,
-      'image_link': ven.image_link,
-      'seeking_talent': ven.seeking_talent,
-      'seeking_description': ven.seeking_description,
-      'past_shows_count': ven.past_shows_count,
-      'upcoming_shows_count': ven.upcoming_shows_count,
-      "upcoming_shows": [{
-        "artist_id":show.artist_id,
-        "artist_name": art.name,
-        "artist_image_link": art.image_link,
-        "start_time": show.start_time
-      }]
-      }
-  elif ven.past_shows_count > 0 and ven.upcoming_shows_count == 0 :
-    data={
-      'id': ven.id,
-      'name': ven.name,
-      'genres': ven.genres,
-      'city': ven.city,
-      'state': ven.state,
-      'address': ven.address,
-      'phone': ven.phone,
-      'website': ven.website_link,
-      'facebook_link': ven.facebook_link,
-      'image_link': ven.image_link,
-      'seeking_talent': ven.seeking_talent,
-      'seeking_description': ven.seeking_description,
-      'past_shows_count': ven.past_shows_count,
-      'upcoming_shows_count': ven.upcoming_shows_count,
-      "past_shows": [{
-        "artist_id": show.artist_id,
-        "artist_name": art.name,
-        "artist_image_link": art.image_link,
-        "start_time": show.start_time
-      }]
-      }
-  else:
-    data={
-      'id': ven.id,
-      'name': ven.name,
-      'genres': ven.genres,
-      'city': ven.city,
-      'state': ven.state,
-      'address': ven.address,
-      'phone': ven.phone,
-      'website': ven.website_link,
-      'facebook_link': ven.facebook_link,
-      'image_link': ven.image_link,
-      'seeking_talent': ven.seeking_talent,
-      'seeking_description': ven.seeking_description,
-      'past_shows_count': ven.past_shows_count,
-      'upcoming_shows_count': ven.upcoming_shows_count
-      }
+  # The venue, and every show there with its artist, split around now.
+  ven, shows = page_entity(Venue, venue_id,
+    db.select(
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      Show.start_time
+    ).join(Artist, Show.artist_id == Artist.id) \
+      .where(Show.venue_id == venue_id) \
+      .order_by(Show.start_time)
+  )
+
+  now = datetime.now()
+  past_shows = [row._asdict() for row in shows if row.start_time < now]
+  upcoming_shows = [row._asdict() for row in shows if row.start_time >= now]
+
+  data={
+    'id': ven.id,
+    'name': ven.name,
+    'genres': ven.genres,
+    'city': ven.city,
+    'state': ven.state,
+    'address': ven.address,
+    'phone': ven.phone,
+    'website': ven.website_link,
+    'facebook_link': ven.facebook_link,
+    'image_link': ven.image_link,
+    'seeking_talent': ven.seeking_talent,
+    'seeking_description': ven.seeking_description,
+    'past_shows': past_shows,
+    'upcoming_shows': upcoming_shows,
+    'past_shows_count': len(past_shows),
+    'upcoming_shows_count': len(upcoming_shows)
+  }
 
   return render_template('pages/show_venue.html', venue=data)
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@main.route('/venues/create', methods=['GET'])
 def create_venue_form():
 
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@main.route('/venues/create', methods=['POST'])
 def create_venue_submission():
 
   error = False
@@ -279,27 +409,32 @@ def create_venue_submission():
       )
     db.session.add(venue)
     db.session.commit()
+    page_cache.invalidate('venues')
+    suggestions.add('venue', venue.id, venue.name)
   except:
     error = True
     db.session.rollback()
     print(sys.exc_info())
   finally:
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
-    db.session.close()
     if error == True:
       abort(400)
       flash('An error occurred. Venue ' + Venue.name + ' could not be listed.')
     else:
       return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['POST'])
+@main.route('/venues/<venue_id>', methods=['POST'])
+@query_budget(9)
 def delete_venue(venue_id):
 
     error = False
     try:
       venue = Venue.query.get(venue_id)
+      stale_pages = venue_page_keys(venue.id)
       db.session.delete(venue)
       db.session.commit()
+      page_cache.invalidate('venues', 'shows', *stale_pages)
+      suggestions.remove('venue', int(venue_id))
       flash('Venue was successfully deleted!')
     except:
       error = True
@@ -307,137 +442,82 @@ def delete_venue(venue_id):
       print(sys.exc_info())
       flash('An error occurred. Venue ' + Venue.name + ' could not be deleted.')
     finally:
-      db.session.close()
       return render_template('pages/home.html')
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@main.route('/artists')
+@query_budget(3)
+@conditional(artists_state)
+@page_cache.cached('artists')
 def artists():
 
-  data = []
-  showartists = Artist.query.all()
+  statement, facets, genre_filter = genre_filter_query(Artist, db.select(Artist.id, Artist.name))
+  rows, facets = async_db.fetch(statement, facets)
 
-  for artist in showartists:
+  data = []
+  for artist in rows:
     data.append({
       "id": artist.id,
       "name": artist.name
     })
 
-  return render_template('pages/artists.html', artists=data)
+  return render_template('pages/artists.html', artists=data, facets=facets, genre_filter=genre_filter)
 
-@app.route('/artists/search', methods=['POST'])
+@main.route('/artists/search', methods=['GET', 'POST'])
+@query_budget(1)
+@routing.read_only
 def search_artists():
 
-  art_search = Artist.query.filter(Artist.name.ilike('%' + request.form.get('search_term', '') + '%')).all()
-  response={
-    "count": len(art_search),
-    "data": art_search
-  } 
+  response, search_term = search_page(Artist)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
-
-@app.route('/artists/<int:artist_id>')
+@main.route('/artists/<int:artist_id>')
+@query_budget(2)
+@conditional(artist_state)
+@page_cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
 
-  art = Artist.query.get(artist_id)
-  show = Show.query.join(Artist).filter(Show.artist_id == art.id).first()
-  art_db = Artist.query.join(Show).filter(Artist.id==Show.artist_id).first()
-
-  if art.past_shows_count > 0 and art.upcoming_shows_count > 0:
-    data={
-      'id': art.id,
-      'name': art.name,
-      'genres': art.genres,
-      'city': art.city,
-      'state': art.state,
-      'phone': art.phone,
-      'website': art.website_link,
-      'facebook_link': art.facebook_link,
-      'image_link': art.image_link,
-      'seeking_venue': art.seeking_venue,
-      'seeking_description': art.seeking_description,
-      'past_shows_count': art.past_shows_count,
-      'upcoming_shows_count': art.upcoming_shows_count,
-      "past_shows": [{
-        "artist_id": show.artist_id,
-        "artist_name": art_db.name,
-        "artist_image_link": art_db.image_link,
-        "start_time": show.start_time
-      }],
-      "upcoming_shows": [{
-        "artist_id":show.artist_id,
-        "artist_name": art_db.name,
-        "artist_image_link": art_db.image_link,
-        "start_time": show.start_time
-      }]
-    }
-  elif art.past_shows_count == 0 and art.upcoming_shows_count > 0:
-    data={
-      'id': art.id,
-      'name': art.name,
-      'genres': art.genres,
-      'city': art.city,
-      'state': art.state,
-      'phone': art.phone,
-      'website': art.website_link,
-      'facebook_link': art.facebook_link,
-      'image_link': art.image_link,
-      'seeking_venue': art.seeking_venue,
-      'seeking_description': art.seeking_description,
-      'past_shows_count': art.past_shows_count,
-      'upcoming_shows_count': art.upcoming_shows_count,
-      "upcoming_shows": [{
-        "artist_id":show.artist_id,
-        "artist_name": art_db.name,
-        "artist_image_link": art_db.image_link,
-        "start_time": show.start_time
-      }]
-    }
-  elif art.past_shows_count > 0 and art.upcoming_shows_count == 0:
-    data={
-      'id': art.id,
-      'name': art.name,
-      'genres': art.genres,
-      'city': art.city,
-      'state': art.state,
-      'phone': art.phone,
-      'website': art.website_link,
-      'facebook_link': art.facebook_link,
-      'image_link': art.image_link,
-      'seeking_venue': art.seeking_venue,
-      'seeking_description': art.seeking_description,
-      'past_shows_count': art.past_shows_count,
-      'upcoming_shows_count': art.upcoming_shows_count,
-      "past_shows": [{
-        "artist_id": show.artist_id,
-        "artist_name": art_db.name,
-        "artist_image_link": art_db.image_link,
-        "start_time": show.start_time
-      }]
-    }
-  else:
-    data={
-      'id': art.id,
-      'name': art.name,
-      'genres': art.genres,
-      'city': art.city,
-      'state': art.state,
-      'phone': art.phone,
-      'website': art.website_link,
-      'facebook_link': art.facebook_link,
-      'image_link': art.image_link,
-      'seeking_venue': art.seeking_venue,
-      'seeking_description': art.seeking_description,
-      'past_shows_count': art.past_shows_count,
-      'upcoming_shows_count': art.upcoming_shows_count,
-    }
+  # The artist, and every show by them with its venue, split around now.
+  art, shows = page_entity(Artist, artist_id,
+    db.select(
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Venue.image_link.label('venue_image_link'),
+      Show.start_time
+    ).join(Venue, Show.venue_id == Venue.id) \
+      .where(Show.artist_id == artist_id) \
+      .order_by(Show.start_time)
+  )
+
+  now = datetime.now()
+  past_shows = [row._asdict() for row in shows if row.start_time < now]
+  upcoming_shows = [row._asdict() for row in shows if row.start_time >= now]
+
+  data={
+    'id': art.id,
+    'name': art.name,
+    'genres': art.genres,
+    'city': art.city,
+    'state': art.state,
+    'phone': art.phone,
+    'website': art.website_link,
+    'facebook_link': art.facebook_link,
+    'image_link': art.image_link,
+    'seeking_venue': art.seeking_venue,
+    'seeking_description': art.seeking_description,
+    'past_shows': past_shows,
+    'upcoming_shows': upcoming_shows,
+    'past_shows_count': len(past_shows),
+    'upcoming_shows_count': len(upcoming_shows)
+  }
 
   return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@main.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_artist(artist_id):
 
   form = ArtistForm()
@@ -445,13 +525,14 @@ def edit_artist(artist_id):
 
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@main.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
 
   error = False
   form = ArtistForm(request.form)
   try:
     artist = Artist.query.get(artist_id)
+    stale_pages = artist_page_keys(artist.id)
     artist.name=form.name.data
     artist.city=form.city.data
     artist.state=form.state.data
@@ -464,20 +545,22 @@ def edit_artist_submission(artist_id):
     artist.seeking_description=form.seeking_description.data
     db.session.add(artist)
     db.session.commit()
+    page_cache.invalidate('artists', 'shows', *stale_pages)
+    suggestions.add('artist', artist.id, artist.name)
   except:
     error = True
     print(sys.exc_info())
     db.session.rollback()
   finally:
     flash('Artist ' + artist.name + ' was successfully edited!')
-    db.session.close()
     if error == True:
       abort(400)
       flash('An error occurred. Artist ' + artist.name + ' could not be edited.')
     else:
-      return redirect(url_for('show_artist', artist_id=artist_id))
+      return redirect(url_for('main.show_artist', artist_id=artist_id))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@main.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@query_budget(1)
 def edit_venue(venue_id):
   
   form = VenueForm()
@@ -485,13 +568,14 @@ def edit_venue(venue_id):
 
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@main.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
 
   error = False
   form = VenueForm(request.form)
   try:
     venue = Venue.query.get(venue_id)
+    stale_pages = venue_page_keys(venue.id)
     venue.name=form.name.data
     venue.city=form.city.data
     venue.state=form.state.data
@@ -505,29 +589,30 @@ def edit_venue_submission(venue_id):
     venue.seeking_description=form.seeking_description.data
     db.session.add(venue)
     db.session.commit()
+    page_cache.invalidate('venues', 'shows', *stale_pages)
+    suggestions.add('venue', venue.id, venue.name)
   except:
     error = True
     print(sys.exc_info())
     db.session.rollback()
   finally:
     flash('Venue ' + venue.name + ' was successfully edited!')
-    db.session.close()
     if error == True:
       abort(400)
       flash('An error occurred. Venue ' + venue.name + ' could not be edited.')
     else:
-      return redirect(url_for('show_venue', venue_id=venue_id))
+      return redirect(url_for('main.show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@main.route('/artists/create', methods=['GET'])
 def create_artist_form():
 
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@main.route('/artists/create', methods=['POST'])
 def create_artist_submission():
 
   error = False
@@ -547,12 +632,13 @@ def create_artist_submission():
       )
     db.session.add(artist)
     db.session.commit()
+    page_cache.invalidate('artists')
+    suggestions.add('artist', artist.id, artist.name)
   except:
     error = True
     print(sys.exc_info())
     db.session.rollback()
   finally:
-    db.session.close()
     if error == True:
       abort(400)
       flash('An error occurred. Artist ' + Artist.name + ' could not be listed.')
@@ -560,14 +646,18 @@ def create_artist_submission():
       flash('Artist ' + request.form['name'] + ' was successfully listed!')
       return render_template('pages/home.html')
 
-@app.route('/artist/<artist_id>', methods=['POST'])
+@main.route('/artist/<artist_id>', methods=['POST'])
+@query_budget(9)
 def delete_artist(artist_id):
 
     error = False
     try:
       artist = Artist.query.get(artist_id)
+      stale_pages = artist_page_keys(artist.id)
       db.session.delete(artist)
       db.session.commit()
+      page_cache.invalidate('artists', 'shows', *stale_pages)
+      suggestions.remove('artist', int(artist_id))
       flash('Artist was successfully deleted!')
     except:
       error = True
@@ -575,82 +665,623 @@ def delete_artist(artist_id):
       db.session.rollback()
       flash('An error occurred. Artist ' + artist.name + ' could not be deleted.')
     finally:
-      db.session.close()
       return render_template('pages/home.html')
 
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
-def shows():
+def encode_cursor(start_time, show_id):
+  raw = '{}|{}'.format(start_time.isoformat(), show_id)
+  return base64.urlsafe_b64encode(raw.encode()).decode()
 
-  data = []
-  showshows = Show.query.all()
+def decode_cursor(cursor):
+  try:
+    start_time, show_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(start_time), int(show_id)
+  except (ValueError, UnicodeDecodeError):
+    abort(400)
+
+def parse_range_bound(value, end=False):
+  # ?from= and ?to= take a date or a date and time. A bare `to` date
+  # includes that whole day.
+  if not value:
+    return None
+  try:
+    bound = datetime.fromisoformat(value)
+  except ValueError:
+    abort(400)
+  if end and len(value) == 10:
+    bound += timedelta(days=1)
+  return bound
+
+def show_range_filters():
+  genre = request.args.get('genre')
+  if genre:
+    genre = next((known for known in GENRES if known.lower() == genre.lower()), None)
+    if genre is None:
+      abort(400)
+  return {
+    'start': parse_range_bound(request.args.get('from')),
+    'end': parse_range_bound(request.args.get('to'), end=True),
+    'city': request.args.get('city') or None,
+    'state': (request.args.get('state') or '').upper() or None,
+    'genre': genre,
+  }
+
+def show_listing_query(start=None, end=None, city=None, state=None, genre=None):
+  # Shows starting in [start, end), ordered by (start_time, id), read from
+  # the show_feed table alone: an index range scan of (start_time, id), or
+  # of (state, city, start_time) when filtering by area. The listing, the
+  # home page and the calendar feeds are all built on it.
+  query = db.session.query(
+    ShowFeed.id,
+    ShowFeed.start_time,
+    ShowFeed.end_time,
+    ShowFeed.venue_id,
+    ShowFeed.venue_name,
+    ShowFeed.venue_address,
+    ShowFeed.venue_city,
+    ShowFeed.venue_state,
+    ShowFeed.artist_id,
+    ShowFeed.artist_name,
+    ShowFeed.artist_image_link
+  )
+
+  if start:
+    query = query.filter(ShowFeed.start_time >= start)
+  if end:
+    query = query.filter(ShowFeed.start_time < end)
+  if city:
+    query = query.filter(ShowFeed.venue_city == city)
+  if state:
+    query = query.filter(ShowFeed.venue_state == state)
+  if genre:
+    query = query.filter(search.genre_match(ShowFeed.artist_genres, [genre], db.session.connection().dialect.name))
+  return query.order_by(ShowFeed.start_time, ShowFeed.id)
+
+@main.route('/shows')
+@query_budget(1)
+def shows():
 
-  for show in showshows:
-    artist = Artist.query.get(show.artist_id)
-    venue = Venue.query.get(show.venue_id)
-    data.append({
-      "venue_id": show.venue_id,
-      "venue_name": venue.name,
-      "artist_id": show.artist_id,
-      "artist_name": artist.name,
-      "artist_image_link": artist.image_link,
-      "start_time": show.start_time
-    })
+  per_page = request.args.get('limit', current_app.config['SHOWS_PER_PAGE'], type=int)
+  per_page = max(1, min(per_page, current_app.config['SHOWS_MAX_PER_PAGE']))
+  filters = show_range_filters()
+
+  # Paged by (start_time, id) so each page is an index range scan however
+  # large the table gets.
+  query = show_listing_query(**filters)
+  after = request.args.get('after')
+  if after:
+    query = query.filter(db.tuple_(ShowFeed.start_time, ShowFeed.id) > decode_cursor(after))
+
+  rows, = async_db.fetch(query.limit(per_page + 1).statement)
+
+  next_cursor = None
+  if len(rows) > per_page:
+    rows = rows[:per_page]
+    next_cursor = encode_cursor(rows[-1].start_time, rows[-1].id)
+
+  data = [{
+    "venue_id": row.venue_id,
+    "venue_name": row.venue_name,
+    "artist_id": row.artist_id,
+    "artist_name": row.artist_name,
+    "artist_image_link": row.artist_image_link,
+    "start_time": row.start_time
+  } for row in rows]
+
+  # Filters are carried over to the next page's link.
+  filter_args = {name: request.args[name] for name in ('from', 'to', 'city', 'state', 'genre') if request.args.get(name)}
+  response = current_app.make_response(render_template('pages/shows.html', shows=data,
+    next_cursor=next_cursor, limit=per_page, filters=filter_args, states=STATES, genres=GENRES))
+  if filters['state'] or filters['city']:
+    # Remembered for the home page's upcoming shows.
+    response.set_cookie(AREA_COOKIE, '{}|{}'.format(filters['state'] or '', filters['city'] or ''),
+      max_age=365 * 24 * 3600, samesite='Lax')
+  return response
+
+#  Calendar feeds
+#  ----------------------------------------------------------------
 
-  return render_template('pages/shows.html', shows=data)
+def calendar_events(query):
+  # Rows come off a server-side cursor, like the exports.
+  config = current_app.config
+  zone = dates.get_timezone(config['DATE_TIMEZONE'])
+  host = request.host.split(':')[0]
+  # DTSTAMP is when the feed was generated, as for any published calendar.
+  stamp = datetime.now(timezone.utc)
+  for row in query.yield_per(config['EXPORT_BATCH_SIZE']):
+    start = zone.localize(row.start_time)
+    yield ical.event(
+      uid='show-{}@{}'.format(row.id, host),
+      start=start,
+      end=zone.localize(row.end_time),
+      summary='{} at {}'.format(row.artist_name, row.venue_name),
+      stamp=stamp,
+      location=', '.join(part for part in (row.venue_name, row.venue_address, row.venue_city, row.venue_state) if part),
+      url=url_for('main.show_venue', venue_id=row.venue_id, _external=True)
+    )
 
-@app.route('/shows/create')
+def calendar_response(name, criterion):
+  # Without ?from=, a feed starts CALENDAR_PAST_DAYS back so recent shows
+  # stay in subscribers' calendars.
+  filters = show_range_filters()
+  start = filters['start'] or datetime.now() - timedelta(days=current_app.config['CALENDAR_PAST_DAYS'])
+  query = show_listing_query(start=start, end=filters['end']).filter(criterion)
+  response = Response(stream_with_context(ical.calendar(name, calendar_events(query))),
+    mimetype='text/calendar')
+  response.headers['Content-Disposition'] = 'inline; filename=calendar.ics'
+  return response
+
+@main.route('/venues/<int:venue_id>/calendar.ics')
+@query_budget(2)
+@routing.read_only
+@conditional(venue_state)
+def venue_calendar(venue_id):
+  venue = page_entity(Venue, venue_id)[0]
+  return calendar_response('{} | Fyyur'.format(venue.name), ShowFeed.venue_id == venue_id)
+
+@main.route('/artists/<int:artist_id>/calendar.ics')
+@query_budget(2)
+@routing.read_only
+@conditional(artist_state)
+def artist_calendar(artist_id):
+  artist = page_entity(Artist, artist_id)[0]
+  return calendar_response('{} | Fyyur'.format(artist.name), ShowFeed.artist_id == artist_id)
+
+@main.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@main.route('/shows/create', methods=['POST'])
+@query_budget(10)
 def create_show_submission():
 
-  error = False
   form = ShowForm(request.form)
+  status, _ = book_shows([{
+    'venue_id': form.venue_id.data,
+    'artist_id': form.artist_id.data,
+    'start_time': form.start_time.data,
+  }])
+  if status == 409:
+    flash('The venue or the artist already has a show at that time. Show could not be listed.')
+    return render_template('forms/new_show.html', form=form), status
+  if status != 201:
+    flash('An error occurred. Show could not be listed.')
+    return render_template('forms/new_show.html', form=form), status
+  flash('Show was successfully listed!')
+  return render_template('pages/home.html')
+
+@main.cli.command('rollover-shows')
+def rollover_shows_command():
+  """Move shows that have started from upcoming to past counts."""
+  with db.engine.begin() as connection:
+    moved = rollover_shows(connection)
+  page_cache.invalidate('venues')
+  print('Moved {} shows from upcoming to past.'.format(moved))
+
+#  Bulk import
+#  ----------------------------------------------------------------
+
+def import_records(model, records):
+  columns = model.__table__.c
+  with db.engine.begin() as connection:
+    last_id = connection.execute(db.select(db.func.max(model.id))).scalar() or 0
+    connection.execute(model.__table__.insert(), [
+      {key: value for key, value in record.items() if key in columns} for record in records
+    ])
+    index_genres(connection, model, model.id > last_id)
+  return []
+
+def import_shows(records):
+  refused = []
+  rows = []
+  for record in records:
+    try:
+      rows.append((record, int(record['venue_id']), int(record['artist_id'])))
+    except (TypeError, ValueError):
+      refused.append((record, {'venue_id': ['Not a valid id.'], 'artist_id': ['Not a valid id.']}))
+
+  with db.engine.begin() as connection:
+    # One existence check per side for the whole chunk.
+    venue_ids = set(connection.execute(
+      db.select(Venue.id).where(Venue.id.in_({venue_id for _, venue_id, _ in rows}))).scalars())
+    artist_ids = set(connection.execute(
+      db.select(Artist.id).where(Artist.id.in_({artist_id for _, _, artist_id in rows}))).scalars())
+
+    now = datetime.now()
+    duration = timedelta(minutes=current_app.config['SHOW_DURATION_MINUTES'])
+    shows, show_records = [], []
+    for record, venue_id, artist_id in rows:
+      if venue_id not in venue_ids:
+        refused.append((record, {'venue_id': ['Unknown venue.']}))
+      elif artist_id not in artist_ids:
+        refused.append((record, {'artist_id': ['Unknown artist.']}))
+      else:
+        start_time = record['start_time']
+        shows.append({'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time,
+          'end_time': start_time + duration, 'is_upcoming': start_time > now})
+        show_records.append(record)
+
+    if shows:
+      last_id, ids = booking.insert_shows(connection, shows)
+      # Shows that overlap one booked before them, or an earlier row, are
+      # taken out again and refused.
+      own_ids, clashes = set(ids), {}
+      for overlap in booking.find_overlaps(connection, lambda new: new.c.id > last_id,
+          current_app.config['SHOW_MAX_DURATION_MINUTES']):
+        if overlap[0] in own_ids:
+          clashes.setdefault(overlap[0], overlap[10])
+      if clashes:
+        connection.execute(Show.__table__.delete().where(Show.id.in_(clashes)))
+        kept = []
+        for id, show, record in zip(ids, shows, show_records):
+          if id in clashes:
+            refused.append((record, {'start_time': ['The {} already has a show at that time.'.format(clashes[id])]}))
+          else:
+            kept.append(show)
+        shows = kept
+      refresh_show_feed(connection, Show.id > last_id)
+      adjust_show_counts(connection, show_count_deltas(
+        (show['venue_id'], show['artist_id'], show['is_upcoming']) for show in shows))
+  return refused
+
+IMPORTERS = {
+  'venues': (VenueForm, functools.partial(import_records, Venue)),
+  'artists': (ArtistForm, functools.partial(import_records, Artist)),
+  'shows': (ShowForm, import_shows),
+}
+
+@main.cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--chunk-size', default=5000, show_default=True, help='Rows per INSERT batch and transaction.')
+@click.option('--rejects', type=click.File('w'), help='Write rejected rows and their errors here as JSON Lines.')
+def import_command(kind, path, fmt, chunk_size, rejects):
+  """Load venues, artists or shows from a CSV or JSON Lines file."""
+  form_class, insert_chunk = IMPORTERS[kind]
+  form = form_class(meta={'csrf': False})
+
+  def progress(report):
+    click.echo('{} rows, {} rejected ({:.0f} rows/s)'.format(
+      report.inserted, report.rejected, report.rate), err=True)
+
+  report = bulk.load(bulk.read_rows(path, fmt), form, insert_chunk,
+    chunk_size=chunk_size, rejects=rejects, progress=progress)
+  page_cache.clear()
+  click.echo(report.summary())
+
+#  Export
+#  ----------------------------------------------------------------
+
+def show_details_query():
+  return db.select(
+    Show.id,
+    Show.start_time,
+    Show.venue_id,
+    Venue.name.label('venue_name'),
+    Venue.city.label('venue_city'),
+    Venue.state.label('venue_state'),
+    Show.artist_id,
+    Artist.name.label('artist_name')
+  ).join(Venue, Show.venue_id == Venue.id) \
+    .join(Artist, Show.artist_id == Artist.id) \
+    .order_by(Show.start_time, Show.id)
+
+EXPORTS = {
+  'venues': lambda: db.select(Venue.__table__).order_by(Venue.id),
+  'artists': lambda: db.select(Artist.__table__).order_by(Artist.id),
+  'shows': lambda: db.select(Show.__table__).order_by(Show.id),
+  'show-details': show_details_query,
+}
+
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+def export_dataset(dataset, fmt):
+  # Rows come off a server-side cursor in batches, so neither the database
+  # driver nor this process ever holds the whole table.
+  batch_size = current_app.config['EXPORT_BATCH_SIZE']
+  # Read from a replica when serving a request, from the primary otherwise.
+  with db.session.get_bind().connect() as connection:
+    result = connection.execution_options(stream_results=True, max_row_buffer=batch_size) \
+      .execute(EXPORTS[dataset]())
+    yield from bulk.export_rows(result, list(result.keys()), fmt, batch_size=batch_size)
+
+@main.route('/api/export/<dataset>')
+def export(dataset):
+
+  fmt = request.args.get('format', 'csv')
+  if dataset not in EXPORTS or fmt not in EXPORT_MIMETYPES:
+    abort(404)
+  response = Response(stream_with_context(export_dataset(dataset, fmt)), mimetype=EXPORT_MIMETYPES[fmt])
+  response.headers['Content-Disposition'] = 'attachment; filename={}.{}'.format(dataset, fmt)
+  return response
+
+@main.cli.command('export')
+@click.argument('dataset', type=click.Choice(sorted(EXPORTS)))
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_MIMETYPES)), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Defaults to stdout.')
+def export_command(dataset, fmt, output):
+  """Stream venues, artists, shows or show-details as CSV or JSON Lines."""
+  for chunk in export_dataset(dataset, fmt):
+    output.write(chunk)
+
+#  JSON API
+#  ----------------------------------------------------------------
+
+def api_columns(model, exclude=('version',)):
+  return {prop.key: getattr(model, prop.key) for prop in db.inspect(model).column_attrs
+    if prop.key not in exclude}
+
+API_RESOURCES = {
+  'venues': (Venue, api_columns(Venue)),
+  'artists': (Artist, api_columns(Artist)),
+  'shows': (Show, dict(api_columns(Show, exclude=('version', 'is_upcoming')),
+    venue_name=Venue.name,
+    venue_image_link=Venue.image_link,
+    artist_name=Artist.name,
+    artist_image_link=Artist.image_link)),
+}
+
+API_JOINS = {
+  Show: ((Venue, Show.venue_id == Venue.id), (Artist, Show.artist_id == Artist.id)),
+}
+
+def api_select(model, columns, fields):
+  stmt = db.select(*[columns[field].label(field) for field in fields]).select_from(model)
+  # Only join the tables a requested field actually comes from.
+  for related, onclause in API_JOINS.get(model, ()):
+    if any(columns[field].class_ is related for field in fields):
+      stmt = stmt.join(related, onclause)
+  return stmt
+
+@main.route('/api/v1/<resource>')
+@query_budget(1)
+def api_list(resource):
+
+  if resource not in API_RESOURCES:
+    api.error('Unknown resource.', 404)
+  model, columns = API_RESOURCES[resource]
+  fields = api.requested_fields(columns)
+  after, limit = api.page_args()
+
+  stmt = api_select(model, columns, fields)
+  if after is not None:
+    stmt = stmt.where(model.id > after)
+  rows = db.session.execute(stmt.order_by(model.id).limit(limit + 1)).all()
+  return api.page_response(rows, fields, limit)
+
+@main.route('/api/v1/<resource>/<int:id>')
+@query_budget(1)
+def api_detail(resource, id):
+
+  if resource not in API_RESOURCES:
+    api.error('Unknown resource.', 404)
+  model, columns = API_RESOURCES[resource]
+  fields = api.requested_fields(columns)
+
+  row = db.session.execute(api_select(model, columns, fields).where(model.id == id)).first()
+  if row is None:
+    api.error('Not found.', 404)
+  return api.json_response({'data': dict(zip(fields, row))})
+
+#  Booking
+#  ----------------------------------------------------------------
+
+def book_shows(items):
+  # Book a batch of show dicts (see booking.parse_bookings), all of them or
+  # none, in one transaction. Returns the status and body of the booking
+  # API's response; the form books a batch of one the same way.
+  config = current_app.config
+  bookings, errors = booking.parse_bookings(items, config['SHOW_DURATION_MINUTES'],
+    config['SHOW_MAX_DURATION_MINUTES'], dates.get_timezone(config['DATE_TIMEZONE']))
+  if errors:
+    return 400, {'errors': [{'index': i, 'errors': problems} for i, problems in sorted(errors.items())]}
+
   try:
-    show = Show( 
-      artist_id=form.artist_id.data,
-      venue_id=form.show.venue_id.data, 
-      start_start=form.start_time.data
-      )
-    db.session.add(show)
-    db.session.commit()
-  except:
-    error = True
-    db.session.rollback()
-    print(sys.exec_info())
-  finally:
-    db.session.close()
-    if error == True:
-      abort(400)
-      flash('An error occurred. Show could not be listed.')
-    else:
-      flash('Show was successfully listed!')
-      return render_template('pages/home.html')
+    with db.engine.begin() as connection:
+      missing_venues, missing_artists = booking.missing_entities(connection, bookings)
+      if missing_venues or missing_artists:
+        errors = []
+        for i, entry in enumerate(bookings):
+          problems = {}
+          if entry['venue_id'] in missing_venues:
+            problems['venue_id'] = ['Unknown venue.']
+          if entry['artist_id'] in missing_artists:
+            problems['artist_id'] = ['Unknown artist.']
+          if problems:
+            errors.append({'index': i, 'errors': problems})
+        return 400, {'errors': errors}
+      shows = booking.book_shows(connection, bookings, config['SHOW_MAX_DURATION_MINUTES'])
+  except booking.BookingConflict as conflict:
+    return 409, {'conflicts': conflict.conflicts}
+  except IntegrityError:
+    # PostgreSQL's exclusion constraints caught an overlap with shows
+    # booked at the same time, or a venue or artist was deleted meanwhile.
+    return 409, {'conflicts': [], 'message': 'The shows clash with a change made at the same time; try again.'}
+
+  routing.wrote()
+  page_cache.invalidate('venues', 'shows',
+    *{'venue:%s' % show['venue_id'] for show in shows},
+    *{'artist:%s' % show['artist_id'] for show in shows})
+  return 201, {'data': shows}
+
+@main.route('/api/v1/bookings', methods=['POST'])
+@query_budget(10)
+def api_bookings():
+  # {"shows": [{"venue_id": 1, "artist_id": 2, "start_time": "2026-11-06T20:00",
+  # "end_time": "2026-11-06T23:00"}, ...]}; end_time is optional.
+  payload = request.get_json(silent=True)
+  items = payload.get('shows') if isinstance(payload, dict) else None
+  if not isinstance(items, list) or not items:
+    abort(400, 'Expected a JSON object with a non-empty "shows" list.')
+  if len(items) > current_app.config['BOOKING_MAX_BATCH']:
+    abort(400, 'At most {} shows can be booked at once.'.format(current_app.config['BOOKING_MAX_BATCH']))
+  status, body = book_shows(items)
+  return api.json_response(body, status=status)
+
+#  Matchmaking
+#  ----------------------------------------------------------------
+
+def load_match_features(app):
+  if not has_app_context():
+    # Background rebuilds run outside of any request.
+    with app.app_context():
+      return load_match_features(app)
+  # Plain Core rows: these are whole tables, and ORM rows cost twice as much.
+  connection = db.session.connection()
+  venues = connection.execute(db.select(Venue.id, Venue.name, Venue.city, Venue.state, Venue.genres,
+    Venue.seeking_talent, Venue.past_shows_count)).all()
+  artists = connection.execute(db.select(Artist.id, Artist.name, Artist.city, Artist.state, Artist.genres,
+    Artist.seeking_venue, Artist.past_shows_count)).all()
+  shows = connection.execute(db.select(Show.venue_id, Show.artist_id)).all()
+  return venues, artists, shows
+
+def match_index():
+  # Built on first use, so only workers serving recommendations import
+  # NumPy and hold the matrices.
+  index = current_app.extensions.get('matches')
+  if index is None:
+    import matchmaking
+    index = current_app.extensions.setdefault('matches', matchmaking.MatchIndex(
+      functools.partial(load_match_features, current_app._get_current_object()),
+      ttl=current_app.config['MATCH_INDEX_TTL']))
+  return index
+
+@main.route('/api/v1/<resource>/<int:id>/matches')
+@query_budget(4)
+def api_matches(resource, id):
+  # Artists seeking a venue that suit venue `id`, or venues seeking talent
+  # that suit artist `id`, best first. Building the index on a worker's
+  # first call takes the other three queries.
+
+  models = {'venues': Venue, 'artists': Artist}
+  if resource not in models:
+    abort(404)
+  model = models[resource]
+  entity = db.session.execute(
+    db.select(model.id, model.genres, model.city, model.state).where(model.id == id)).first()
+  if entity is None:
+    abort(404)
+  limit = max(1, min(request.args.get('limit', 10, type=int), current_app.config['MATCH_MAX_RESULTS']))
+  return api.json_response({'data': match_index().matches(resource, entity, limit)})
+
+#  Suggestions
+#  ----------------------------------------------------------------
 
-@app.errorhandler(404)
+def load_suggestions(app):
+  if not has_app_context():
+    # Background rebuilds run outside of any request.
+    with app.app_context():
+      yield from load_suggestions(app)
+    return
+  for id, name in db.session.query(Venue.id, Venue.name).yield_per(1000):
+    yield 'venue', id, name
+  for id, name in db.session.query(Artist.id, Artist.name).yield_per(1000):
+    yield 'artist', id, name
+
+# Each application keeps its own index, built on first use.
+suggestions = LocalProxy(lambda: current_app.extensions['suggestions'])
+
+@main.route('/api/suggest')
+def suggest_names():
+
+  limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+  kind = request.args.get('type')
+  return jsonify(suggestions.lookup(request.args.get('q', ''), limit=limit, kind=kind))
+
+@main.route('/healthz')
+@query_budget(1)
+def healthz():
+  # Probes the primary itself: the session would send this GET's query to a
+  # replica. Replicas are reported, by URL, from their last health check
+  # (see routing.ReplicaSet), so the probe stays a single statement.
+  pool = db.engine.pool
+  stats = {'pool': type(pool).__name__}
+  for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+    if hasattr(pool, name):
+      stats[name] = getattr(pool, name)()
+
+  body = {'status': 'ok', 'database': stats}
+  replicas = current_app.extensions.get('replicas')
+  if replicas is not None:
+    body['replicas'] = {replica.pop('url'): replica for replica in replicas.status()}
+
+  started = time.perf_counter()
+  try:
+    with db.engine.connect() as connection:
+      connection.execute(db.text('SELECT 1'))
+  except Exception as e:
+    stats['error'] = str(e)
+    body['status'] = 'unavailable'
+    return jsonify(body), 503
+  stats['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+  return jsonify(body)
+
+@main.route('/metrics')
+def metrics():
+  return Response(request_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/api/cache/stats')
+def cache_stats():
+  return jsonify(page_cache.stats())
+
+@main.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@main.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+#----------------------------------------------------------------------------#
+# Application factory.
+#----------------------------------------------------------------------------#
+
+def create_app(config='config'):
+  app = Flask(__name__)
+  app.config.from_object(config)
+
+  db.init_app(app)
+  if click.get_current_context(silent=True) is not None:
+    # Only the `flask` command needs Flask-Migrate; web workers skip
+    # importing it and Alembic.
+    from flask_migrate import Migrate
+    Migrate(app, db)
+  moment.init_app(app)
+  page_cache.init_app(app)
+  request_metrics.init_app(app)
+  async_db.init_app(app)
+  app.extensions['suggestions'] = suggest.PrefixIndex(
+    functools.partial(load_suggestions, app), ttl=app.config['SUGGEST_INDEX_TTL'])
+
+  app.jinja_env.filters['datetime'] = format_datetime
+  app.jinja_env.filters['datetimes'] = dates.format_datetimes
+  # Compiled templates are shared between workers and restarts. Without a
+  # configured directory Jinja uses its own, owned by and private to this user.
+  cache_dir = app.config.get('TEMPLATE_BYTECODE_CACHE_DIR')
+  if cache_dir:
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+  else:
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+  app.register_blueprint(main)
+
+  if not app.debug:
+      file_handler = FileHandler('error.log')
+      file_handler.setFormatter(
+          Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+      )
+      app.logger.setLevel(logging.INFO)
+      file_handler.setLevel(logging.INFO)
+      app.logger.addHandler(file_handler)
+      app.logger.info('errors')
+
+  return app
 
 #----------------------------------------------------------------------------#
 # Launch.
@@ -658,11 +1289,11 @@ if not app.debug:
 '''
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 
@@ -0,0 +1,75 @@
+"""Run a view's independent queries concurrently on an async engine.
+
+Views hand their SELECT statements to `fetch()`, which returns the rows of
+each. By default the statements run one after the other on the regular
+session. With ASYNC_QUERIES on they go through an asyncio driver instead
+(asyncpg for PostgreSQL, aiosqlite for SQLite) and run concurrently, each on
+its own connection, so a page waits for its slowest query rather than the
+sum of them.
+
+The database is picked as for any other query (see routing.py), so reads
+still go to a healthy replica unless the client is pinned to the primary.
+
+Flask runs the coroutine on a fresh event loop inside the worker thread.
+That means async engines use NullPool, since asyncio connections cannot
+outlive their loop. With PostgreSQL, put PgBouncer or a similar pooler in
+front when this is on.
+"""
+import asyncio
+
+from flask import current_app
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+# Async driver used for each backend.
+ASYNC_DRIVERS = {
+    'postgresql': 'asyncpg',
+    'sqlite': 'aiosqlite',
+}
+
+
+def async_url(url):
+    """`url` with its driver swapped for the backend's asyncio driver."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError('No async driver for {} databases'.format(backend))
+    return url.set(drivername='{}+{}'.format(backend, ASYNC_DRIVERS[backend]))
+
+
+class AsyncDatabase:
+
+    def __init__(self, db, app=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Sync engine URL -> async engine, created on first use.
+        app.extensions['async_engines'] = {}
+
+    def fetch(self, *statements):
+        """The rows of each statement, as a list of lists."""
+        if not current_app.config.get('ASYNC_QUERIES'):
+            return [self.db.session.execute(statement).all() for statement in statements]
+        return current_app.ensure_sync(self._gather)(self._engine(), statements)
+
+    def _engine(self):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        url = self.db.session.get_bind().url
+        engines = current_app.extensions['async_engines']
+        engine = engines.get(url)
+        if engine is None:
+            options = {}
+            timeout = current_app.config.get('DB_STATEMENT_TIMEOUT_MS')
+            if url.get_backend_name() == 'postgresql' and timeout:
+                options['connect_args'] = {'server_settings': {'statement_timeout': str(timeout)}}
+            engine = engines.setdefault(url, create_async_engine(async_url(url), poolclass=NullPool, **options))
+        return engine
+
+    async def _gather(self, engine, statements):
+        async def fetch_one(statement):
+            async with engine.connect() as connection:
+                return (await connection.execute(statement)).all()
+        return await asyncio.gather(*(fetch_one(statement) for statement in statements))
@@ -0,0 +1,86 @@
+"""Measure worker cold start: import, create_app() and the first request.
+
+Every run happens in a fresh interpreter, the way a new worker boots, so
+nothing is shared through the module cache:
+
+    python benchmarks/cold_start.py --runs 20
+    python benchmarks/cold_start.py --path /venues --json results.json
+
+The database configured by DATABASE_URL is only touched if the requested
+path queries it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+status = application.test_client().get(sys.argv[1]).status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'status': status,
+}))
+'''
+
+
+def run_once(path):
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, path],
+        cwd=ROOT, check=True, capture_output=True, text=True
+    ).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings['process'] = time.perf_counter() - started
+    return timings
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'min_ms': round(samples[0] * 1000, 2),
+        'median_ms': round(statistics.median(samples) * 1000, 2),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/', help='Path requested once the app is created.')
+    parser.add_argument('--json', dest='output', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    results = {
+        'runs': args.runs,
+        'path': args.path,
+        'status': sorted({run['status'] for run in runs}),
+        'phases': {
+            phase: summarize([run[phase] for run in runs])
+            for phase in ('import', 'create_app', 'first_request', 'process')
+        },
+    }
+
+    for phase, stats in results['phases'].items():
+        print('{:<14} min {min_ms:>8.2f} ms  median {median_ms:>8.2f} ms  p95 {p95_ms:>8.2f} ms'.format(phase, **stats))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Requests per second of one process under concurrent load, sync vs async.
+
+Each mode builds its own application, the second with ASYNC_QUERIES on
+(see asyncdb.py), and is then driven by a growing number of client threads:
+
+    python benchmarks/concurrency.py --clients 1 8 32 --seconds 5
+    python benchmarks/concurrency.py --modes async --json async.json
+
+Requests cycle through the views that fetch() their queries, with the ids
+in their URLs drawn at random from the database generate.py filled. The page
+cache and query budgets are off, as in routes.py.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def paths(ids, rng):
+    return lambda: rng.choice([
+        '/venues/{}'.format(rng.choice(ids['venue'])),
+        '/artists/{}'.format(rng.choice(ids['artist'])),
+        '/venues',
+        '/shows',
+        '/venues/search?search_term=blue',
+        '/artists/search?search_term=fox',
+    ])
+
+
+def drive(app, next_path, clients, seconds):
+    """(requests, errors, latencies) from `clients` threads over `seconds`."""
+    deadline = time.perf_counter() + seconds
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def client():
+        test_client = app.test_client()
+        local, failed = [], 0
+        while time.perf_counter() < deadline:
+            with lock:
+                path = next_path()
+            started = time.perf_counter()
+            response = test_client.get(path)
+            response.get_data()
+            local.append(time.perf_counter() - started)
+            failed += response.status_code >= 500
+            response.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+    parser.add_argument('--modes', nargs='+', choices=['sync', 'async'], default=['sync', 'async'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='output', help='Write the results to this file.')
+    args = parser.parse_args()
+
+    import config
+    config.CACHE_BACKEND = 'none'
+    config.QUERY_BUDGET_MODE = 'off'
+
+    from app import create_app
+    from models import Artist, Venue, db
+
+    results = {'seconds': args.seconds, 'modes': {}}
+    for mode in args.modes:
+        config.ASYNC_QUERIES = mode == 'async'
+        app = create_app(config)
+        with app.app_context():
+            ids = {
+                'venue': db.session.query(Venue.id).limit(10000).all(),
+                'artist': db.session.query(Artist.id).limit(10000).all(),
+            }
+        ids = {kind: [id for id, in rows] for kind, rows in ids.items()}
+        if not all(ids.values()):
+            parser.error('the database is empty; fill it with benchmarks/generate.py first')
+
+        next_path = paths(ids, random.Random(args.seed))
+        drive(app, next_path, 1, min(1.0, args.seconds))  # warm up
+        runs = results['modes'][mode] = {}
+        for clients in args.clients:
+            requests, errors, latencies, elapsed = drive(app, next_path, clients, args.seconds)
+            latencies.sort()
+            runs[clients] = {
+                'requests': requests,
+                'errors': errors,
+                'throughput_rps': round(requests / elapsed, 1),
+                'p50_ms': round(statistics.median(latencies) * 1000, 2),
+                'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+            }
+            print('{:<6} {:>3} clients  {throughput_rps:>8.1f} req/s  p50 {p50_ms:>8.2f} ms  p99 {p99_ms:>8.2f} ms'
+                .format(mode, clients, **runs[clients]) + ('  {} errors'.format(errors) if errors else ''))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if any(run['errors'] for runs in results['modes'].values() for run in runs.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
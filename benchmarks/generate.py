@@ -0,0 +1,187 @@
+"""Fill the database configured by DATABASE_URL with synthetic data.
+
+    python benchmarks/generate.py --scale 100k
+    python benchmarks/generate.py --shows 250000 --venues 5000 --artists 20000 --reset
+
+The schema is brought up to date with the migrations first. Shows are spread
+over three years around today, so about a third of them are upcoming,
+without double-booking any venue or artist, and the show counters, show feed and genre index are filled in to match. The
+same --seed always produces the same data.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Number of shows at each scale; venues and artists are derived from it.
+SCALES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+
+CHUNK_SIZE = 10000
+
+# Show slots are counted from here.
+GRID_START = datetime(2000, 1, 1)
+
+ADJECTIVES = ['Blue', 'Golden', 'Velvet', 'Electric', 'Hidden', 'Silver', 'Crooked', 'Midnight',
+    'Neon', 'Rusty', 'Wild', 'Quiet', 'Lucky', 'Broken', 'Crimson', 'Paper']
+NOUNS = ['Room', 'Owl', 'Harbor', 'Lantern', 'Garden', 'Anchor', 'Tiger', 'Cellar',
+    'Engine', 'Mirror', 'Palace', 'Fox', 'Signal', 'Orchard', 'Comet', 'Barrel']
+CITIES = ['San Francisco', 'New York', 'Austin', 'Chicago', 'Seattle', 'Nashville', 'Denver',
+    'Portland', 'Boston', 'Atlanta', 'Detroit', 'Miami', 'Oakland', 'Brooklyn', 'Phoenix', 'Memphis']
+
+
+def name(rng, i, suffix=''):
+    # The running number keeps names unique at any scale.
+    return '{} {}{} {}'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS), suffix, i)
+
+
+def venue_rows(rng, count, states, genres):
+    for i in range(count):
+        yield {
+            'name': 'The ' + name(rng, i),
+            'city': rng.choice(CITIES),
+            'state': rng.choice(states),
+            'address': '{} Main Street'.format(rng.randint(1, 9999)),
+            'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+            'genres': rng.sample(genres, rng.randint(1, 3)),
+            'seeking_talent': rng.random() < 0.3,
+            'seeking_description': '',
+            'image_link': 'https://picsum.photos/seed/venue{}/300/300'.format(i),
+            'website_link': '',
+            'facebook_link': '',
+            'past_shows_count': 0,
+            'upcoming_shows_count': 0,
+        }
+
+
+def artist_rows(rng, count, states, genres):
+    for i in range(count):
+        yield {
+            'name': name(rng, i, suffix='s'),
+            'city': rng.choice(CITIES),
+            'state': rng.choice(states),
+            'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randint(200, 999), rng.randint(0, 999), rng.randint(0, 9999)),
+            'genres': rng.sample(genres, rng.randint(1, 2)),
+            'seeking_venue': rng.random() < 0.3,
+            'seeking_description': '',
+            'image_link': 'https://picsum.photos/seed/artist{}/300/300'.format(i),
+            'website_link': '',
+            'facebook_link': '',
+            'past_shows_count': 0,
+            'upcoming_shows_count': 0,
+        }
+
+
+def show_rows(rng, count, venue_ids, artist_ids, now, duration, booked):
+    # Shows fill whole slots of `duration` on a grid, and no venue or artist
+    # plays two in one slot, so they never overlap (and pass the booking
+    # constraints on PostgreSQL). `booked` holds the taken (kind, id, slot).
+    first = int((now - timedelta(days=730) - GRID_START) / duration)
+    span = int(timedelta(days=1095) / duration)
+    for _ in range(count):
+        while True:
+            slot = first + rng.randrange(span)
+            venue = ('venue', rng.choice(venue_ids), slot)
+            artist = ('artist', rng.choice(artist_ids), slot)
+            if venue not in booked and artist not in booked:
+                break
+        booked.update((venue, artist))
+        start_time = GRID_START + slot * duration
+        yield {
+            'venue_id': venue[1],
+            'artist_id': artist[1],
+            'start_time': start_time,
+            'end_time': start_time + duration,
+            'is_upcoming': start_time > now,
+        }
+
+
+def booked_slots(shows, duration):
+    """(kind, id, slot) of every grid slot taken by `shows`, existing
+    (venue_id, artist_id, start_time, end_time) rows."""
+    booked = set()
+    for venue_id, artist_id, start_time, end_time in shows:
+        last = (end_time - GRID_START - timedelta(microseconds=1)) // duration
+        for slot in range((start_time - GRID_START) // duration, last + 1):
+            booked.update((('venue', venue_id, slot), ('artist', artist_id, slot)))
+    return booked
+
+
+def insert(connection, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            connection.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        connection.execute(table.insert(), chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES, key=SCALES.get), default='10k')
+    parser.add_argument('--shows', type=int, help='Overrides --scale.')
+    parser.add_argument('--venues', type=int, help='Defaults to one per 20 shows.')
+    parser.add_argument('--artists', type=int, help='Defaults to one per 10 shows.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='Delete existing venues, artists and shows first.')
+    args = parser.parse_args()
+
+    shows = args.shows or SCALES[args.scale]
+    venues = args.venues or max(1, shows // 20)
+    artists = args.artists or max(1, shows // 10)
+
+    import flask_migrate
+    from app import GENRES, create_app
+    from forms import VenueForm
+    from models import Artist, GenreCount, GenreTag, Show, ShowFeed, Venue, db, index_genres, refresh_show_feed
+
+    app = create_app()
+    flask_migrate.Migrate(app, db)
+    rng = random.Random(args.seed)
+    states = [value for value, label in VenueForm.state.kwargs['choices']]
+    started = time.perf_counter()
+
+    with app.app_context():
+        flask_migrate.upgrade(directory=os.path.join(ROOT, 'migrations'))
+        with db.engine.begin() as connection:
+            if args.reset:
+                for model in (ShowFeed, Show, Venue, Artist, GenreCount):
+                    connection.execute(model.__table__.delete())
+                if connection.dialect.name != 'postgresql':
+                    connection.execute(GenreTag.__table__.delete())
+
+            for model, rows in ((Venue, venue_rows(rng, venues, states, GENRES)),
+                                (Artist, artist_rows(rng, artists, states, GENRES))):
+                last_id = connection.execute(db.select(db.func.max(model.id))).scalar() or 0
+                insert(connection, model.__table__, rows)
+                index_genres(connection, model, model.id > last_id)
+            venue_ids = connection.execute(db.select(Venue.id)).scalars().all()
+            artist_ids = connection.execute(db.select(Artist.id)).scalars().all()
+            duration = timedelta(minutes=app.config['SHOW_DURATION_MINUTES'])
+            booked = booked_slots(connection.execute(
+                db.select(Show.venue_id, Show.artist_id, Show.start_time, Show.end_time)), duration)
+            insert(connection, Show.__table__, show_rows(rng, shows, venue_ids, artist_ids, datetime.now(), duration, booked))
+
+            # Counters for every venue and artist, in the same way the
+            # maintained_show_counts migration backfills them.
+            for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+                connection.execute(db.text(
+                    'UPDATE {table} SET '
+                    'upcoming_shows_count = (SELECT count(*) FROM shows WHERE shows.{key} = {table}.id AND shows.is_upcoming), '
+                    'past_shows_count = (SELECT count(*) FROM shows WHERE shows.{key} = {table}.id AND NOT shows.is_upcoming)'
+                    .format(table=table, key=key)
+                ))
+            refresh_show_feed(connection)
+
+    print('Inserted {} venues, {} artists and {} shows in {:.1f}s'.format(
+        venues, artists, shows, time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""Latency and throughput of every route, through the Flask test client.
+
+Run it against a database filled by generate.py:
+
+    python benchmarks/routes.py --requests 200 --json results.json
+    python benchmarks/routes.py --compare results.json
+
+Each case gets a few warm-up requests and then --requests timed ones, with
+the ids in its URL drawn at random (with --seed) from the existing rows. The
+page cache is off unless --cache is given, so the numbers measure the work
+behind each page. Results include the git commit they were taken on, and
+--compare prints the change against an earlier results file.
+
+The write cases (form submissions, bookings and deletes) change the
+database, so run them against a throwaway copy; they come after the reads,
+and the deletes last, each removing a different venue or artist. The bulk
+import is a CLI command rather than a route and is not timed here.
+
+The exit status is 1 if any request fails with a server error. With
+--budgets, requests that go over their view's query budget fail too, e.g.
+a delete whose statement count grows with the number of shows.
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WARMUP = 3
+
+# Delete cases and the kind of row each request removes.
+DELETE_CASES = {'venue-delete': 'venue', 'artist-delete': 'artist'}
+
+
+def cases(ids, rng):
+    """Benchmark case name -> (route rule, function returning a URL)."""
+    def some(kind):
+        return lambda: rng.choice(ids[kind])
+
+    venue, artist, show = some('venue'), some('artist'), some('show')
+    # A page of the venues listing part way through, from state "M" on.
+    venues_from_m = base64.urlsafe_b64encode(json.dumps(['M', '', 0]).encode()).decode()
+    # Saturdays within the generated data's three years.
+    first = date.today() - timedelta(days=730)
+    weekends = [(first + timedelta(days=day)).isoformat() for day in range(1095) if (first + timedelta(days=day)).weekday() == 5]
+    return {
+        'home': ('/', lambda: '/'),
+        'venues': ('/venues', lambda: '/venues'),
+        'venues-from-m': ('/venues', lambda: '/venues?after=' + venues_from_m),
+        'venues-genres': ('/venues', lambda: '/venues?genre=Jazz&genre=Blues&match=all'),
+        'venue': ('/venues/<int:venue_id>', lambda: '/venues/{}'.format(venue())),
+        'venue-calendar': ('/venues/<int:venue_id>/calendar.ics', lambda: '/venues/{}/calendar.ics'.format(venue())),
+        'venue-edit-form': ('/venues/<int:venue_id>/edit', lambda: '/venues/{}/edit'.format(venue())),
+        'venue-create-form': ('/venues/create', lambda: '/venues/create'),
+        'venue-search': ('/venues/search', lambda: '/venues/search?search_term=blue'),
+        'venue-search-city': ('/venues/search', lambda: '/venues/search?search_term=Austin,+TX'),
+        'artists': ('/artists', lambda: '/artists'),
+        'artists-genre': ('/artists', lambda: '/artists?genre=Folk'),
+        'artist': ('/artists/<int:artist_id>', lambda: '/artists/{}'.format(artist())),
+        'artist-calendar': ('/artists/<int:artist_id>/calendar.ics', lambda: '/artists/{}/calendar.ics'.format(artist())),
+        'artist-edit-form': ('/artists/<int:artist_id>/edit', lambda: '/artists/{}/edit'.format(artist())),
+        'artist-create-form': ('/artists/create', lambda: '/artists/create'),
+        'artist-search': ('/artists/search', lambda: '/artists/search?search_term=fox'),
+        'shows': ('/shows', lambda: '/shows'),
+        'shows-weekend': ('/shows', lambda: '/shows?from={0}&to={0}&city=Austin'.format(rng.choice(weekends))),
+        'show-create-form': ('/shows/create', lambda: '/shows/create'),
+        'api-venues': ('/api/v1/<resource>', lambda: '/api/v1/venues'),
+        'api-shows': ('/api/v1/<resource>', lambda: '/api/v1/shows?fields=start_time,venue_name,artist_name'),
+        'api-venue': ('/api/v1/<resource>/<int:id>', lambda: '/api/v1/venues/{}'.format(venue())),
+        'api-show': ('/api/v1/<resource>/<int:id>', lambda: '/api/v1/shows/{}'.format(show())),
+        'api-venue-matches': ('/api/v1/<resource>/<int:id>/matches', lambda: '/api/v1/venues/{}/matches'.format(venue())),
+        'api-artist-matches': ('/api/v1/<resource>/<int:id>/matches', lambda: '/api/v1/artists/{}/matches'.format(artist())),
+        'suggest': ('/api/suggest', lambda: '/api/suggest?q=' + rng.choice(['bl', 'gol', 'the n', 'fox'])),
+        'export-venues': ('/api/export/<dataset>', lambda: '/api/export/venues?format=jsonl'),
+        'healthz': ('/healthz', lambda: '/healthz'),
+        'metrics': ('/metrics', lambda: '/metrics'),
+        'cache-stats': ('/api/cache/stats', lambda: '/api/cache/stats'),
+    }
+
+
+def write_cases(ids, rng):
+    """Benchmark case name -> (route rule, function returning a URL and the
+    keyword arguments of its POST request).
+    """
+    def some(kind):
+        return lambda: rng.choice(ids[kind])
+
+    def taken(kind):
+        # Each delete removes a row no later request names.
+        pool = ids[kind][:]
+        rng.shuffle(pool)
+        return pool.pop
+
+    def form(**fields):
+        return dict({'city': 'Austin', 'state': 'TX', 'phone': '512-555-0100', 'genres': ['Jazz', 'Blues'],
+            'image_link': '', 'facebook_link': '', 'website_link': '', 'seeking_description': ''}, **fields)
+
+    def some_time():
+        # Far enough ahead of the generated shows to rarely clash with them.
+        start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=rng.randrange(1200, 3000))
+        return start.replace(hour=rng.randrange(12, 23))
+
+    venue, artist = some('venue'), some('artist')
+    deleted_venue, deleted_artist = taken('venue'), taken('artist')
+    return {
+        'venue-create': ('/venues/create', lambda: ('/venues/create',
+            {'data': form(name='Bench Hall', address='1 Main St', seeking_talent='y')})),
+        'venue-edit': ('/venues/<int:venue_id>/edit', lambda: ('/venues/{}/edit'.format(venue()),
+            {'data': form(name='Bench Hall (edited)', address='2 Main St')})),
+        'venue-search-form': ('/venues/search', lambda: ('/venues/search', {'data': {'search_term': 'blue'}})),
+        'artist-create': ('/artists/create', lambda: ('/artists/create',
+            {'data': form(name='Bench Band', seeking_venue='y')})),
+        'artist-edit': ('/artists/<int:artist_id>/edit', lambda: ('/artists/{}/edit'.format(artist()),
+            {'data': form(name='Bench Band (edited)')})),
+        'artist-search-form': ('/artists/search', lambda: ('/artists/search', {'data': {'search_term': 'fox'}})),
+        'show-create': ('/shows/create', lambda: ('/shows/create', {'data': {
+            'venue_id': venue(), 'artist_id': artist(), 'start_time': some_time().strftime('%Y-%m-%d %H:%M:%S')}})),
+        'api-bookings': ('/api/v1/bookings', lambda: ('/api/v1/bookings', {'json': {'shows': [
+            {'venue_id': venue(), 'artist_id': artist(), 'start_time': some_time().isoformat()} for _ in range(10)]}})),
+        'venue-delete': ('/venues/<venue_id>', lambda: ('/venues/{}'.format(deleted_venue()), {})),
+        'artist-delete': ('/artist/<artist_id>', lambda: ('/artist/{}'.format(deleted_artist()), {})),
+    }
+
+
+def percentile(samples, fraction):
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def send(client, method, request):
+    # request: a URL, or a URL and the test client's keyword arguments.
+    url, kwargs = (request, {}) if isinstance(request, str) else request
+    return client.open(url, method=method, **kwargs)
+
+
+def run_case(client, method, url_for_request, requests):
+    for _ in range(WARMUP):
+        send(client, method, url_for_request()).close()
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        request = url_for_request()
+        request_started = time.perf_counter()
+        response = send(client, method, request)
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started)
+        errors += response.status_code >= 500
+        response.close()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / elapsed, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 3),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p90_ms': round(percentile(latencies, 0.90) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    previous = baseline['routes'] if baseline else {}
+    for name, stats in results['routes'].items():
+        line = '{:<20} p50 {p50_ms:>9.2f} ms  p99 {p99_ms:>9.2f} ms  {throughput_rps:>8.1f} req/s'.format(name, **stats)
+        if name in previous:
+            before = previous[name]['p50_ms']
+            line += '  p50 {:+.1f}%'.format((stats['p50_ms'] - before) / before * 100 if before else 0)
+        if stats['errors']:
+            line += '  {} errors'.format(stats['errors'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='Timed requests per case.')
+    parser.add_argument('--only', action='append', help='Run just this case (repeatable).')
+    parser.add_argument('--cache', action='store_true', help='Leave the page cache on.')
+    parser.add_argument('--budgets', action='store_true',
+        help='Fail requests that go over their query budget or repeat a statement (N+1).')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='output', help='Write the results to this file.')
+    parser.add_argument('--compare', type=argparse.FileType(), help='Earlier results to compare with.')
+    args = parser.parse_args()
+
+    import config
+    if not args.cache:
+        config.CACHE_BACKEND = 'none'
+    # Off unless asked for: checking them adds to every request's time.
+    config.QUERY_BUDGET_MODE = 'raise' if args.budgets else 'off'
+
+    from app import create_app
+    from models import Artist, Show, Venue, db
+
+    app = create_app(config)
+    rng = random.Random(args.seed)
+    with app.app_context():
+        ids = {
+            'venue': db.session.query(Venue.id).limit(10000).all(),
+            'artist': db.session.query(Artist.id).limit(10000).all(),
+            'show': db.session.query(Show.id).limit(10000).all(),
+        }
+        counts = {name: model.query.count() for name, model in (('venues', Venue), ('artists', Artist), ('shows', Show))}
+        dialect = db.engine.dialect.name
+    ids = {kind: [id for id, in rows] for kind, rows in ids.items()}
+    if not all(ids.values()):
+        parser.error('the database is empty; fill it with benchmarks/generate.py first')
+
+    all_cases = {name: ('GET',) + case for name, case in cases(ids, rng).items()}
+    all_cases.update((name, ('POST',) + case) for name, case in write_cases(ids, rng).items())
+    routes = {(method, rule.rule) for rule in app.url_map.iter_rules() if rule.endpoint != 'static'
+        for method in ('GET', 'POST') if method in rule.methods}
+    for method, rule in sorted(routes - {(method, rule) for method, rule, _ in all_cases.values()}):
+        print('warning: no benchmark case for {} {}'.format(method, rule), file=sys.stderr)
+
+    client = app.test_client()
+    results = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'database': dialect,
+        'rows': counts,
+        'cache': args.cache,
+        'routes': {},
+    }
+    for name, (method, rule, url_for_request) in all_cases.items():
+        if args.only and name not in args.only:
+            continue
+        if name in DELETE_CASES and len(ids[DELETE_CASES[name]]) < WARMUP + args.requests:
+            print('warning: too few rows for {} requests of {}; skipped'.format(WARMUP + args.requests, name),
+                file=sys.stderr)
+            continue
+        results['routes'][name] = dict(run_case(client, method, url_for_request, args.requests),
+            method=method, rule=rule)
+
+    print_results(results, json.load(args.compare) if args.compare else None)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if any(stats['errors'] for stats in results['routes'].values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
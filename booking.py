@@ -0,0 +1,196 @@
+"""Booking shows in batches without double-booking venues or artists.
+
+A batch (e.g. a tour of a few hundred dates) is booked in one transaction:
+its venues and artists are looked up in a single query, the shows are
+inserted, and one query per side then looks for any show that overlaps a
+new one at the same venue or with the same artist. If there is any, the
+whole batch is rolled back.
+
+Checking after the insert means the check also covers the batch itself, and
+on SQLite, where the insert takes the database's write lock, no other
+booking can slip in between. On PostgreSQL, concurrent transactions do not
+see each other's rows, so the shows_*_no_overlap exclusion constraints
+check again at commit.
+
+Overlaps are found with the (venue_id, start_time) and (artist_id,
+start_time) indexes. No show is longer than SHOW_MAX_DURATION_MINUTES, so
+only shows starting that long before a new one need to be looked at.
+"""
+from datetime import datetime, timedelta
+
+from models import Artist, Show, Venue, adjust_show_counts, db, refresh_show_feed, show_count_deltas
+
+# Fields of a booking besides the optional end_time.
+REQUIRED_FIELDS = ('venue_id', 'artist_id', 'start_time')
+SHOW_FIELDS = ('venue_id', 'artist_id', 'start_time', 'end_time')
+
+
+class BookingConflict(Exception):
+    """Raised with the overlaps found; the transaction is to be rolled back."""
+
+    def __init__(self, conflicts):
+        super().__init__('{} booking(s) overlap other shows'.format(len(conflicts)))
+        self.conflicts = conflicts
+
+
+def parse_time(value, tzinfo):
+    # Show times are stored naive, in the site's zone (DATE_TIMEZONE).
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).strip())
+    if value.tzinfo is not None:
+        value = value.astimezone(tzinfo).replace(tzinfo=None)
+    return value
+
+
+def parse_bookings(items, duration_minutes, max_minutes, tzinfo):
+    """(bookings, errors) for a list of booking dicts, e.g. decoded JSON.
+
+    Each booking gets an end_time, `duration_minutes` after its start unless
+    given. Times with a UTC offset are converted to `tzinfo`. `errors` maps
+    the position of each invalid item to its field errors, in the forms'
+    format.
+    """
+    bookings, errors = [], {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[i] = {'booking': ['Not an object.']}
+            continue
+        booking, problems = {}, {}
+        for key in REQUIRED_FIELDS:
+            if item.get(key) in (None, ''):
+                problems[key] = ['This field is required.']
+        for key in ('venue_id', 'artist_id'):
+            if key not in problems:
+                try:
+                    booking[key] = int(item[key])
+                except (TypeError, ValueError):
+                    problems[key] = ['Not a valid id.']
+        for key in ('start_time', 'end_time'):
+            if key not in problems and item.get(key) not in (None, ''):
+                try:
+                    booking[key] = parse_time(item[key], tzinfo)
+                except (TypeError, ValueError):
+                    problems[key] = ['Not a valid datetime value.']
+        if 'start_time' in booking:
+            start = booking['start_time']
+            end = booking.setdefault('end_time', start + timedelta(minutes=duration_minutes))
+            if 'end_time' not in problems:
+                if end <= start:
+                    problems['end_time'] = ['Must be after the start time.']
+                elif end - start > timedelta(minutes=max_minutes):
+                    problems['end_time'] = ['Shows can be at most {} minutes long.'.format(max_minutes)]
+        if problems:
+            errors[i] = problems
+        else:
+            bookings.append(booking)
+    return bookings, errors
+
+
+def missing_entities(connection, bookings):
+    """(venue ids, artist ids) named in `bookings` that do not exist."""
+    venue_ids = {booking['venue_id'] for booking in bookings}
+    artist_ids = {booking['artist_id'] for booking in bookings}
+    found = connection.execute(db.union_all(
+        db.select(db.literal('venue').label('kind'), Venue.id).where(Venue.id.in_(venue_ids)),
+        db.select(db.literal('artist').label('kind'), Artist.id).where(Artist.id.in_(artist_ids)),
+    )).all()
+    return (venue_ids - {id for kind, id in found if kind == 'venue'},
+        artist_ids - {id for kind, id in found if kind == 'artist'})
+
+
+def minutes_before(column, minutes, dialect_name):
+    if dialect_name == 'sqlite':
+        # datetime() drops the fraction of a second, which only makes this
+        # lower bound a little looser.
+        return db.func.datetime(column, '-{} minutes'.format(int(minutes)))
+    return column - timedelta(minutes=minutes)
+
+
+def find_overlaps(connection, criterion, max_minutes):
+    """(new show, other show, side) rows for shows matching `criterion` that
+    overlap a show inserted before them at the same venue or with the same
+    artist; `side` is 'venue' or 'artist'.
+
+    Each clash is reported once, against the later show, so two shows of
+    one batch that overlap come out as a single row.
+    """
+    shows = Show.__table__
+    new = shows.alias('new')
+    other = shows.alias('other')
+    statements = []
+    for side in ('venue', 'artist'):
+        key = side + '_id'
+        statements.append(
+            db.select(
+                new.c.id, new.c.venue_id, new.c.artist_id, new.c.start_time, new.c.end_time,
+                other.c.id, other.c.venue_id, other.c.artist_id, other.c.start_time, other.c.end_time,
+                db.literal(side),
+            ).join(other, db.and_(
+                other.c[key] == new.c[key],
+                other.c.start_time < new.c.end_time,
+                other.c.start_time >= minutes_before(new.c.start_time, max_minutes, connection.dialect.name),
+                other.c.end_time > new.c.start_time,
+                other.c.id < new.c.id,
+            )).where(criterion(new))
+        )
+    return connection.execute(db.union_all(*statements)).all()
+
+
+def show_dict(id, venue_id, artist_id, start_time, end_time):
+    return {'id': id, 'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time, 'end_time': end_time}
+
+
+def insert_shows(connection, rows):
+    """Insert show rows with one executemany. Returns the highest show id
+    before the insert and the new ids, in the order of `rows`.
+    """
+    last_id = connection.execute(db.select(db.func.max(Show.id))).scalar() or 0
+    connection.execute(Show.__table__.insert(), rows)
+
+    # Match the new ids to rows by their fields, since on PostgreSQL shows
+    # committed meanwhile by others can have ids above last_id too.
+    waiting = {}
+    for i, row in enumerate(rows):
+        waiting.setdefault(tuple(row[key] for key in SHOW_FIELDS), []).append(i)
+    ids = [None] * len(rows)
+    for id, *fields in connection.execute(
+            db.select(Show.id, *(Show.__table__.c[key] for key in SHOW_FIELDS))
+            .where(Show.id > last_id).order_by(Show.id)):
+        queue = waiting.get(tuple(fields))
+        if queue:
+            ids[queue.pop(0)] = id
+    return last_id, ids
+
+
+def book_shows(connection, bookings, max_minutes):
+    """Insert `bookings` (see parse_bookings) and keep the counters and show
+    feed in step. Returns the new shows as dicts, in booking order.
+
+    Raises BookingConflict, listing each booking's position and the show it
+    overlaps, when any of them clash; the caller's transaction must then be
+    rolled back.
+    """
+    if not bookings:
+        return []
+    now = datetime.now()
+    rows = [dict(booking, is_upcoming=booking['start_time'] > now) for booking in bookings]
+    last_id, ids = insert_shows(connection, rows)
+    position = {id: i for i, id in enumerate(ids)}
+
+    conflicts = []
+    for row in find_overlaps(connection, lambda new: new.c.id > last_id, max_minutes):
+        if row[0] not in position:
+            continue
+        conflict = {'index': position[row[0]], 'with': row[10]}
+        if row[5] in position:
+            conflict['booking'] = position[row[5]]
+        else:
+            conflict['show'] = show_dict(*row[5:10])
+        conflicts.append(conflict)
+    if conflicts:
+        raise BookingConflict(sorted(conflicts, key=lambda conflict: conflict['index']))
+
+    refresh_show_feed(connection, Show.id > last_id)
+    adjust_show_counts(connection, show_count_deltas(
+        (row['venue_id'], row['artist_id'], row['is_upcoming']) for row in rows))
+    return [show_dict(id, *(row[key] for key in SHOW_FIELDS)) for id, row in zip(ids, rows)]
@@ -0,0 +1,198 @@
+"""Bulk loading and export of venues, artists and shows as CSV or JSON Lines.
+
+Imported rows are streamed from disk, validated with the same WTForms form
+the web UI uses (one bound form instance is reused for every row) and handed
+to an insert callback in fixed-size chunks, so memory use depends on the
+chunk size and not on the size of the file. Exports are generated batch by
+batch from a server-side cursor in the same two formats.
+"""
+import csv
+import io
+import json
+import time
+from datetime import date, datetime
+
+from werkzeug.datastructures import MultiDict
+
+# Separators accepted between the values of a multi-valued CSV cell (genres).
+LIST_SEPARATORS = (';', '|')
+
+
+def detect_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class UnreadableRow:
+    """A JSON Lines line that does not hold a JSON object, in place of its row."""
+
+    def __init__(self, text, error):
+        self.text = text
+        self.error = error
+
+
+def read_rows(path, fmt=None):
+    """Yield (line number, row dict) pairs from a CSV or JSON Lines file.
+
+    A JSON Lines line that cannot be read comes as an UnreadableRow, to be
+    rejected like any invalid row.
+    """
+    fmt = fmt or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, start=1):
+                text = line.rstrip('\r\n')
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                except json.JSONDecodeError as e:
+                    row = UnreadableRow(text, 'Not valid JSON ({}, column {}).'.format(e.msg, e.colno))
+                else:
+                    if not isinstance(row, dict):
+                        row = UnreadableRow(text, 'Not a JSON object.')
+                yield line_number, row
+
+
+def to_formdata(row, list_fields=(), bool_fields=()):
+    items = []
+    for key, value in row.items():
+        if value is None or key is None:
+            continue
+        if key in list_fields:
+            if isinstance(value, str):
+                for separator in LIST_SEPARATORS:
+                    value = value.replace(separator, ',')
+                value = [item.strip() for item in value.split(',') if item.strip()]
+            items.extend((key, item) for item in value)
+        elif key in bool_fields:
+            # A BooleanField is checked whenever the key is submitted at all.
+            if value is True or str(value).strip().lower() in ('1', 'y', 'yes', 'true', 't'):
+                items.append((key, 'y'))
+        else:
+            items.append((key, str(value)))
+    return MultiDict(items)
+
+
+def validate_rows(rows, form):
+    """Yield (line number, row, record, errors) for each row.
+
+    `record` is the form's data for valid rows and None otherwise. Required
+    fields must be in the row itself: a field's default (e.g. ShowForm's
+    start_time) would otherwise stand in for a missing value.
+    """
+    list_fields = {field.name for field in form if field.type == 'SelectMultipleField'}
+    bool_fields = {field.name for field in form if field.type == 'BooleanField'}
+    required = [field.name for field in form if field.flags.required]
+    for line_number, row in rows:
+        if isinstance(row, UnreadableRow):
+            yield line_number, row.text, None, {'row': [row.error]}
+            continue
+        missing = {name: ['This field is required.'] for name in required if row.get(name) in (None, '', [])}
+        if missing:
+            yield line_number, row, None, missing
+            continue
+        form.process(to_formdata(row, list_fields, bool_fields))
+        if form.validate():
+            record = dict(form.data)
+            record.pop('csrf_token', None)
+            yield line_number, row, record, None
+        else:
+            yield line_number, row, None, form.errors
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.inserted = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return (self.inserted + self.rejected) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return '{} inserted, {} rejected in {:.1f}s ({:.0f} rows/s)'.format(
+            self.inserted, self.rejected, self.elapsed, self.rate)
+
+
+def load(rows, form, insert_chunk, chunk_size=5000, rejects=None, progress=None):
+    """Validate `rows` with `form` and insert them in chunks.
+
+    insert_chunk(records) writes one chunk in its own transaction and
+    returns the (record, errors) pairs it refused, e.g. shows pointing at
+    an unknown venue. Rejected rows are written to `rejects` as JSON Lines,
+    in line order, and `progress(report)` is called after every chunk.
+    """
+    report = ImportReport()
+
+    def flush(chunk, invalid):
+        # invalid: (line number, row, errors) of the rows read along with
+        # the chunk that failed validation.
+        refused = insert_chunk([record for _, record in chunk]) if chunk else []
+        lines = {id(record): line_number for line_number, record in chunk}
+        invalid.extend((lines[id(record)], record, errors) for record, errors in refused)
+        invalid.sort(key=lambda reject: reject[0])
+        report.inserted += len(chunk) - len({id(record) for record, _ in refused})
+        report.rejected += len(invalid)
+        if rejects is not None:
+            for line_number, row, errors in invalid:
+                rejects.write(json.dumps({'line': line_number, 'row': row, 'errors': errors}, default=str) + '\n')
+        if progress is not None:
+            progress(report)
+
+    chunk, invalid = [], []
+    for line_number, row, record, errors in validate_rows(rows, form):
+        if errors:
+            invalid.append((line_number, row, errors))
+            if len(invalid) >= chunk_size:
+                flush(chunk, invalid)
+                chunk, invalid = [], []
+            continue
+        chunk.append((line_number, record))
+        if len(chunk) >= chunk_size:
+            flush(chunk, invalid)
+            chunk, invalid = [], []
+    if chunk or invalid:
+        flush(chunk, invalid)
+    return report
+
+
+def _export_value(value, fmt):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, (list, tuple)) and fmt == 'csv':
+        # Same separator the importer splits genres on.
+        return LIST_SEPARATORS[0].join(value)
+    return value
+
+
+def export_rows(rows, columns, fmt='csv', batch_size=1000):
+    """Yield `rows` as CSV (with a header) or JSON Lines text, one batch per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer is not None:
+        writer.writerow(columns)
+
+    count = 0
+    for row in rows:
+        values = [_export_value(value, fmt) for value in row]
+        if writer is not None:
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values))) + '\n')
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
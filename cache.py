@@ -0,0 +1,259 @@
+"""Response cache for rendered pages.
+
+Pages are stored under a key naming the route and entity ("venues",
+"venue:12", ...). One key holds every query-string variant of that page
+(e.g. each page of the venues listing), so the write handlers can drop
+exactly the keys a commit affects with `invalidate()`.
+
+Templates can also cache expensive fragments with the `{% cache %}` tag:
+
+    {% cache 'venue:%s' % venue.id, 'upcoming' %} ... {% endcache %}
+
+The first argument is the page key the fragment belongs to, so invalidating
+that key drops the fragment too; the remaining ones tell apart fragments
+under the same key.
+
+Two backends are available: an in-process LRU with a TTL (the default) and
+a Redis-compatible server, used when CACHE_BACKEND is "redis" and the redis
+package is installed. The LRU belongs to one process and only sees that
+process's invalidations, so run several workers with Redis.
+"""
+import functools
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, g, make_response, request, session
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Most query-string variants kept under a single key.
+MAX_VARIANTS = 32
+
+# Most template fragments kept under a single key.
+MAX_FRAGMENTS = 64
+
+# Fragments are stored apart from the pages under the same key.
+FRAGMENT_PREFIX = 'fragments:'
+
+
+class LRUBackend:
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {'entries': len(self._data), 'evictions': self.evictions}
+
+
+class RedisBackend:
+
+    def __init__(self, url, ttl=300, prefix='fyyur:page:'):
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self._client.delete(*[self.prefix + key for key in keys])
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+    def stats(self):
+        # Redis evicts for the whole server, not just our keys.
+        return {'evictions': self._client.info('stats').get('evicted_keys', 0)}
+
+
+class ResponseCache:
+
+    def __init__(self, app=None, vary=None):
+        # vary() names whatever else besides the URL a page depends on,
+        # e.g. the locale it was rendered in.
+        self.vary = vary
+        self.backend = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fragment_hits = 0
+        self.fragment_misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.get('CACHE_BACKEND', 'memory')
+        ttl = app.config.get('CACHE_DEFAULT_TTL', 300)
+        if backend == 'redis':
+            if redis is None:
+                raise RuntimeError('CACHE_BACKEND is "redis" but the redis package is not installed')
+            self.backend = RedisBackend(app.config['CACHE_REDIS_URL'], ttl=ttl)
+        elif backend == 'memory':
+            self.backend = LRUBackend(app.config.get('CACHE_MAX_ENTRIES', 1024), ttl=ttl)
+        else:
+            self.backend = None
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+
+    def _count(self, counter):
+        # Worker threads share one ResponseCache.
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def cached(self, key_template):
+        """Cache a GET view under `key_template` formatted with its view args."""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**kwargs):
+                # Pages rendered with pending flash messages are one-off.
+                if self.backend is None or request.method != 'GET' or session.get('_flashes'):
+                    return view(**kwargs)
+
+                key = key_template.format(**kwargs)
+                variant = request.query_string.decode()
+                if self.vary is not None:
+                    variant += '#' + self.vary()
+                # Entries are stored with the state token of the data they
+                # were rendered from (g.page_state, set by conditional views),
+                # so one rendered before a change elsewhere is never served,
+                # even if this process missed the invalidation.
+                state = g.get('page_state')
+                stored = self.backend.get(key)
+                entry = stored[1] if stored is not None and stored[0] == state else {}
+                if variant in entry:
+                    self._count('hits')
+                    body, mimetype = entry[variant]
+                    return Response(body, mimetype=mimetype)
+
+                self._count('misses')
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+                def store(body):
+                    variants = dict(entry) if len(entry) < MAX_VARIANTS else {}
+                    variants[variant] = (body, response.mimetype)
+                    self.backend.set(key, (state, variants))
+
+                if response.is_streamed:
+                    response.response = self._capture(response.response, store)
+                else:
+                    store(response.get_data())
+                return response
+            return wrapper
+        return decorator
+
+    def _capture(self, chunks, store):
+        # Pass a streamed body through untouched and cache it once complete.
+        body = []
+        for chunk in chunks:
+            chunk = chunk.encode() if isinstance(chunk, str) else chunk
+            body.append(chunk)
+            yield chunk
+        store(b''.join(body))
+
+    def fragment(self, key, name, render):
+        """The cached fragment `name` under page key `key`, rendered if missing."""
+        if self.backend is None:
+            return render()
+        if self.vary is not None:
+            name += '#' + self.vary()
+        fragments = self.backend.get(FRAGMENT_PREFIX + key) or {}
+        if name in fragments:
+            self._count('fragment_hits')
+            return Markup(fragments[name])
+
+        self._count('fragment_misses')
+        value = render()
+        fragments = dict(fragments) if len(fragments) < MAX_FRAGMENTS else {}
+        fragments[name] = str(value)
+        self.backend.set(FRAGMENT_PREFIX + key, fragments)
+        return value
+
+    def invalidate(self, *keys):
+        if self.backend is not None:
+            self.backend.delete(*keys, *[FRAGMENT_PREFIX + key for key in keys])
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses, 'evictions': 0,
+                'fragment_hits': self.fragment_hits, 'fragment_misses': self.fragment_misses}
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache key, name... %} ... {% endcache %} tag."""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        fragment_cache = self.environment.fragment_cache
+        if fragment_cache is None:
+            return caller()
+        key, names = str(args[0]), args[1:]
+        return fragment_cache.fragment(key, ':'.join(str(name) for name in names), caller)
@@ -0,0 +1,169 @@
+"""Date formatting for templates, with Babel patterns compiled once.
+
+babel.dates.format_datetime looks up the locale's patterns and parses them
+on every call. Here each (format, locale) pair is compiled into a
+DateTimeFormatter the first time it is used and kept for the life of the
+process. The formatter also remembers what it formatted recently, since
+listings repeat the same show dates and times.
+
+Each request is formatted in its own locale and time zone (see
+request_locale_and_timezone), and these only pick which cached formatter
+and zone to use. Naive datetimes are taken to be in DATE_TIMEZONE.
+"""
+import functools
+import threading
+from datetime import datetime
+
+import babel.dates
+import dateutil.parser
+from babel import Locale
+from flask import current_app, g, has_request_context, request
+
+NAMED_FORMATS = ('full', 'long', 'medium', 'short')
+
+# Patterns used for string input, which are not always complete timestamps.
+STRING_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+# Formatted parts remembered per formatter before the memo starts over.
+MAX_MEMO = 16384
+
+# Cookie that selects the time zone dates are shown in.
+TIMEZONE_COOKIE = 'tz'
+
+
+@functools.lru_cache(maxsize=256)
+def get_timezone(name):
+    return babel.dates.get_timezone(name)
+
+
+class DateTimeFormatter:
+    """A date/time format compiled for one locale.
+
+    Named formats ("full", "medium", ...) are built from a date part and a
+    time part like babel.dates.format_datetime builds them. Besides whole
+    results, each part is remembered separately: a page of shows has few
+    distinct dates and fewer distinct times of day, so even new timestamps
+    are mostly put together from strings formatted earlier.
+    """
+
+    def __init__(self, format, locale):
+        self.locale = Locale.parse(locale)
+        self._lock = threading.Lock()
+        self._memo = {}
+        if format in NAMED_FORMATS:
+            self.pattern = None
+            self.combined = babel.dates.get_datetime_format(format, locale=self.locale).replace("'", "")
+            self.date_pattern = babel.dates.parse_pattern(babel.dates.get_date_format(format, locale=self.locale))
+            self.time_pattern = babel.dates.parse_pattern(babel.dates.get_time_format(format, locale=self.locale))
+        else:
+            self.pattern = babel.dates.parse_pattern(format)
+
+    def __call__(self, value, tzinfo):
+        """Format `value` in `tzinfo`; naive values are taken to be in `tzinfo`."""
+        # The output only depends on the instant and the zone it is shown in.
+        return self._remember((value, tzinfo), self._format, value, tzinfo)
+
+    def _format(self, value, tzinfo, locale):
+        if value.tzinfo is None:
+            value = tzinfo.localize(value) if hasattr(tzinfo, 'localize') else value.replace(tzinfo=tzinfo)
+        else:
+            value = value.astimezone(tzinfo)
+            if hasattr(tzinfo, 'normalize'):
+                value = tzinfo.normalize(value)
+
+        if self.pattern is not None:
+            return self.pattern.apply(value, locale)
+        time = value.timetz()
+        # Times compare equal across zones, so the key carries the tzinfo
+        # (which differs between standard and summer time too).
+        time_text = self._remember(
+            ('time', time.hour, time.minute, time.second, time.microsecond, time.tzinfo),
+            self.time_pattern.apply, time)
+        day = value.date()
+        date_text = self._remember(('date', day), self.date_pattern.apply, day)
+        return self.combined.replace('{0}', time_text).replace('{1}', date_text)
+
+    def _remember(self, key, apply, *args):
+        text = self._memo.get(key)
+        if text is None:
+            text = apply(*args, self.locale)
+            with self._lock:
+                if len(self._memo) >= MAX_MEMO:
+                    self._memo.clear()
+                self._memo[key] = text
+        return text
+
+
+_formatters = {}
+_formatters_lock = threading.Lock()
+
+
+def get_formatter(format, locale):
+    formatter = _formatters.get((format, locale))
+    if formatter is None:
+        with _formatters_lock:
+            formatter = _formatters.setdefault((format, locale), DateTimeFormatter(format, locale))
+    return formatter
+
+
+def request_locale_and_timezone():
+    """(locale, tzinfo) for the current request, worked out once per request.
+
+    The locale is the best match for Accept-Language among DATE_LOCALES, and
+    the zone comes from the "tz" cookie when it names a known zone.
+    """
+    if not has_request_context():
+        config = current_app.config
+        return config.get('DATE_LOCALE', 'en'), get_timezone(config.get('DATE_TIMEZONE', 'UTC'))
+    selected = g.get('date_locale_and_timezone')
+    if selected is None:
+        config = current_app.config
+        locales = config.get('DATE_LOCALES') or [config.get('DATE_LOCALE', 'en')]
+        locale = request.accept_languages.best_match(locales) or config.get('DATE_LOCALE', 'en')
+        try:
+            tzinfo = get_timezone(request.cookies.get(TIMEZONE_COOKIE) or config.get('DATE_TIMEZONE', 'UTC'))
+        except LookupError:
+            tzinfo = get_timezone(config.get('DATE_TIMEZONE', 'UTC'))
+        selected = g.date_locale_and_timezone = (locale, tzinfo)
+    return selected
+
+
+def request_variant():
+    """Locale and zone of the current request, for cache keys."""
+    locale, tzinfo = request_locale_and_timezone()
+    return '{}|{}'.format(locale, getattr(tzinfo, 'zone', tzinfo))
+
+
+def _prepare(value, format):
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = dateutil.parser.parse(value)
+        return value, STRING_FORMATS.get(format, format)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return value, format
+
+
+def format_datetime(value, format='medium'):
+    value, format = _prepare(value, format)
+    locale, tzinfo = request_locale_and_timezone()
+    return get_formatter(format, locale)(value, tzinfo)
+
+
+def format_datetimes(values, format='medium'):
+    """Format a sequence of timestamps at once, e.g. a page of show times."""
+    locale, tzinfo = request_locale_and_timezone()
+    formatters = {}
+    results = []
+    for value in values:
+        value, value_format = _prepare(value, format)
+        formatter = formatters.get(value_format)
+        if formatter is None:
+            formatter = formatters[value_format] = get_formatter(value_format, locale)
+        results.append(formatter(value, tzinfo))
+    return results
@@ -1,14 +1,46 @@
+import os
+import shutil
+import tempfile
+
 from fabric.api import local, settings, abort
 from fabric.contrib.console import confirm
 
 # prepare for deployment
 
+ARTIST_FIELDS = ('"city": "Austin", "state": "TX", "genres": ["Jazz"], "phone": "512-555-0100", '
+    '"image_link": "https://example.com/a.png", "facebook_link": "https://facebook.com/a", '
+    '"website_link": "https://example.com"')
+
+# Two good artists around a line that is not valid JSON: the import has to
+# load both and reject the broken one.
+IMPORT_SAMPLE = '\n'.join([
+    '{"name": "Import One", ' + ARTIST_FIELDS + '}',
+    '{"name": "Import Broken", "city": ',
+    '{"name": "Import Two", ' + ARTIST_FIELDS + '}',
+]) + '\n'
+
 
 def test():
-    with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+    # Every route against a small throwaway SQLite database, created outside
+    # the working tree; the route benchmark exits non-zero if any of them
+    # fails with a server error or goes over its query budget. Then a bulk
+    # import with a broken line.
+    workdir = tempfile.mkdtemp(prefix='fyyur-test-')
+    sample = os.path.join(workdir, 'artists.jsonl')
+    with open(sample, 'w') as f:
+        f.write(IMPORT_SAMPLE)
+    try:
+        with settings(warn_only=True):
+            result = local(
+                "export DATABASE_URL=sqlite:///{} FLASK_APP=app"
+                " && python benchmarks/generate.py --scale 1k --reset"
+                " && python benchmarks/routes.py --requests 5 --budgets"
+                " && flask import artists {} | grep -q '^2 inserted, 1 rejected'".format(
+                    os.path.join(workdir, 'test.db'), sample),
+                capture=True
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
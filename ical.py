@@ -0,0 +1,73 @@
+"""iCalendar (RFC 5545) feeds of shows.
+
+A feed is written out event by event, so a venue or artist with years of
+shows can be streamed straight from a database cursor. Times are given in
+UTC, which every calendar client understands without a VTIMEZONE block.
+"""
+from datetime import timezone
+
+PRODUCT_ID = '-//Fyyur//Shows//EN'
+
+# Content lines longer than this many octets are folded.
+MAX_LINE_OCTETS = 75
+
+
+def escape_text(value):
+    return (str(value or '').replace('\\', '\\\\').replace(';', '\\;')
+        .replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def format_utc(value):
+    """`value`, an aware datetime, as an iCalendar UTC date-time."""
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def content_line(name, value):
+    line = '{}:{}'.format(name, value)
+    encoded = line.encode('utf-8')
+    if len(encoded) <= MAX_LINE_OCTETS:
+        return line + '\r\n'
+    # Fold on character boundaries; continuation lines start with a space.
+    parts, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode('utf-8'))
+        limit = MAX_LINE_OCTETS if not parts else MAX_LINE_OCTETS - 1
+        if size + width > limit:
+            parts.append(current)
+            current, size = '', 0
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def event(uid, start, end, summary, stamp, location=None, url=None):
+    """One VEVENT; `start`, `end` and `stamp` are aware datetimes."""
+    lines = [
+        content_line('BEGIN', 'VEVENT'),
+        content_line('UID', uid),
+        content_line('DTSTAMP', format_utc(stamp)),
+        content_line('DTSTART', format_utc(start)),
+        content_line('DTEND', format_utc(end)),
+        content_line('SUMMARY', escape_text(summary)),
+    ]
+    if location:
+        lines.append(content_line('LOCATION', escape_text(location)))
+    if url:
+        lines.append(content_line('URL', url))
+    lines.append(content_line('END', 'VEVENT'))
+    return ''.join(lines)
+
+
+def calendar(name, events):
+    """Yield a VCALENDAR named `name` around the VEVENT strings in `events`."""
+    yield ''.join((
+        content_line('BEGIN', 'VCALENDAR'),
+        content_line('VERSION', '2.0'),
+        content_line('PRODID', PRODUCT_ID),
+        content_line('CALSCALE', 'GREGORIAN'),
+        content_line('METHOD', 'PUBLISH'),
+        content_line('X-WR-CALNAME', escape_text(name)),
+    ))
+    yield from events
+    yield content_line('END', 'VCALENDAR')
@@ -0,0 +1,283 @@
+"""Per-request timing: wall time, SQL statements and template rendering.
+
+Every request collects how long it took, how many SQL statements it ran and
+how long they took (from the engine's cursor events) and how long its
+templates took to render. The totals are added to per-route metrics served
+in the Prometheus text format, and sent back to the client in a
+Server-Timing header. Statements slower than SLOW_QUERY_MS are logged with
+the route that ran them.
+
+In development and tests the statements of each request are also checked
+against the view's declared `query_budget` and for N+1 patterns: the same
+statement shape run over and over, typically once per row of an earlier
+result. Depending on QUERY_BUDGET_MODE a violation is logged ("warn") or
+raised as QueryBudgetExceeded ("raise", the default under TESTING).
+
+Metrics are kept per process; with several workers, scrape each one or sum
+them in Prometheus.
+"""
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (seconds) of the request duration histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Longest statement text written to the slow query log.
+MAX_LOGGED_STATEMENT = 2000
+
+# How often one statement shape may run in a request before it is reported
+# as an N+1 pattern, unless the view's budget says otherwise.
+DEFAULT_MAX_REPEATS = 5
+
+# A parenthesised list of bind placeholders, e.g. an expanded IN (?, ?, ?).
+_PLACEHOLDER_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))+\s*\)')
+
+
+# Execution option for statements that are not a request's own work, such
+# as replica health checks: they are timed for the slow query log but not
+# counted in the request's stats or against its budget.
+UNCOUNTED = 'uncounted'
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries, max_repeats=None):
+    """Declare how many SQL statements a view may run per request.
+
+    `max_repeats` caps how often a single statement shape may repeat
+    (DEFAULT_MAX_REPEATS when not given). Put it right under the route
+    decorator.
+    """
+    def decorator(view):
+        view._query_budget = (max_queries, max_repeats)
+        return view
+    return decorator
+
+
+def statement_shape(statement):
+    """`statement` with whitespace and placeholder lists collapsed."""
+    return _PLACEHOLDER_LIST.sub('(?)', ' '.join(statement.split()))
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+        # Statement shape -> times run; only kept while budgets are checked.
+        self.shapes = None
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current_stats():
+    """The RequestStats of the running request, or None outside of one."""
+    if has_request_context():
+        return g.get('request_stats')
+    return None
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def add(self, seconds, stats):
+        self.count += 1
+        self.seconds += seconds
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+        self.sql_count += stats.sql_count
+        self.sql_seconds += stats.sql_seconds
+        self.render_seconds += stats.render_seconds
+
+
+class TimedTemplate(Template):
+    """Template that adds its rendering time to the current request."""
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            _add_render_time(time.perf_counter() - started)
+
+    def generate(self, *args, **kwargs):
+        # Streamed templates are timed chunk by chunk, as the body is sent.
+        chunks = super().generate(*args, **kwargs)
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                _add_render_time(time.perf_counter() - started)
+            yield chunk
+
+
+def _add_render_time(seconds):
+    stats = current_stats()
+    if stats is not None:
+        stats.render_seconds += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_started'].pop()
+    uncounted = context is not None and context.execution_options.get(UNCOUNTED, False)
+    stats = None if uncounted else current_stats()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_seconds += seconds
+        if stats.shapes is not None:
+            stats.shapes[statement_shape(statement)] += 1
+
+    if has_app_context():
+        threshold = current_app.config.get('SLOW_QUERY_MS')
+        if threshold and seconds * 1000 >= threshold:
+            route = '{} {}'.format(request.method, request.path) if has_request_context() else '(no request)'
+            current_app.logger.warning(
+                'Slow query (%.1f ms) in %s: %s', seconds * 1000, route, statement[:MAX_LOGGED_STATEMENT])
+
+
+def _listen_to_engines():
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Instrumentation:
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._statuses = Counter()
+        self.server_timing = True
+        self.budget_mode = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.server_timing = app.config.get('SERVER_TIMING', True)
+        self.budget_mode = app.config.get('QUERY_BUDGET_MODE') or (
+            'raise' if app.testing else 'warn' if app.debug else None)
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        _listen_to_engines()
+
+    def _start(self):
+        g.request_stats = RequestStats()
+        if self.budget_mode in ('warn', 'raise'):
+            g.request_stats.shapes = Counter()
+
+    def _finish(self, response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        if stats.shapes is not None:
+            self._check_budget(stats)
+        if self.server_timing:
+            response.headers['Server-Timing'] = ', '.join((
+                'app;dur={:.1f}'.format(stats.elapsed * 1000),
+                'db;dur={:.1f};desc="{} queries"'.format(stats.sql_seconds * 1000, stats.sql_count),
+                'render;dur={:.1f}'.format(stats.render_seconds * 1000),
+            ))
+        # Record once the body has been sent, so streamed pages count in full.
+        key = (request.endpoint or 'unmatched', request.method)
+        status = response.status_code
+        response.call_on_close(lambda: self._record(key, status, stats))
+        return response
+
+    def _check_budget(self, stats):
+        view = current_app.view_functions.get(request.endpoint)
+        max_queries, max_repeats = getattr(view, '_query_budget', (None, None))
+        max_repeats = max_repeats or DEFAULT_MAX_REPEATS
+
+        problems = []
+        if max_queries is not None and stats.sql_count > max_queries:
+            problems.append('{} SQL statements, over its budget of {}'.format(stats.sql_count, max_queries))
+        for shape, count in stats.shapes.most_common():
+            if count <= max_repeats:
+                break
+            problems.append('the same statement {} times (N+1?): {}'.format(count, shape[:MAX_LOGGED_STATEMENT]))
+        if not problems:
+            return
+
+        message = '{} {} ran {}'.format(request.method, request.path, '; '.join(problems))
+        if self.budget_mode == 'raise':
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+
+    def _record(self, key, status, stats):
+        seconds = stats.elapsed
+        with self._lock:
+            self._routes.setdefault(key, RouteStats()).add(seconds, stats)
+            self._statuses[key + (status,)] += 1
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            routes = sorted(self._routes.items())
+            statuses = sorted(self._statuses.items())
+
+        def labels(endpoint, method, **extra):
+            pairs = [('endpoint', endpoint), ('method', method)] + sorted(extra.items())
+            return ','.join('{}="{}"'.format(name, _escape_label(value)) for name, value in pairs)
+
+        lines = [
+            '# HELP fyyur_requests_total Requests handled, by route and status.',
+            '# TYPE fyyur_requests_total counter',
+        ]
+        for (endpoint, method, status), count in statuses:
+            lines.append('fyyur_requests_total{{{}}} {}'.format(labels(endpoint, method, status=status), count))
+
+        lines += [
+            '# HELP fyyur_request_duration_seconds Wall time per request, including streamed bodies.',
+            '# TYPE fyyur_request_duration_seconds histogram',
+        ]
+        for (endpoint, method), route in routes:
+            for bound, count in zip(DURATION_BUCKETS, route.buckets):
+                lines.append('fyyur_request_duration_seconds_bucket{{{}}} {}'.format(
+                    labels(endpoint, method, le=bound), count))
+            lines.append('fyyur_request_duration_seconds_bucket{{{}}} {}'.format(
+                labels(endpoint, method, le='+Inf'), route.count))
+            lines.append('fyyur_request_duration_seconds_sum{{{}}} {}'.format(labels(endpoint, method), route.seconds))
+            lines.append('fyyur_request_duration_seconds_count{{{}}} {}'.format(labels(endpoint, method), route.count))
+
+        for name, help, attribute in (
+            ('fyyur_sql_queries_total', 'SQL statements executed.', 'sql_count'),
+            ('fyyur_sql_duration_seconds_total', 'Time spent executing SQL statements.', 'sql_seconds'),
+            ('fyyur_template_render_seconds_total', 'Time spent rendering templates.', 'render_seconds'),
+        ):
+            lines += ['# HELP {} {}'.format(name, help), '# TYPE {} counter'.format(name)]
+            for (endpoint, method), route in routes:
+                lines.append('{}{{{}}} {}'.format(name, labels(endpoint, method), getattr(route, attribute)))
+        return '\n'.join(lines) + '\n'
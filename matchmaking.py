@@ -0,0 +1,232 @@
+"""Artist/venue matchmaking over precomputed feature matrices.
+
+For a venue, artists seeking a venue are ranked by (and the other way round
+for an artist, venues seeking talent):
+
+- genre overlap: cosine similarity of genre vectors
+- proximity: same city, or failing that same state
+- history: shows the two already played together
+- experience: the candidate's past shows, log-scaled
+
+Every venue and artist is held as rows of NumPy arrays (a genre matrix,
+city and state codes, seeking flags, experience), plus the venue/artist
+show pairs in compressed sparse row form for each direction. A query then
+scores all candidates with one matrix-vector product and a few vectorized
+comparisons and picks the top k with argpartition, so it costs a few
+milliseconds even for 100k candidates.
+
+Like the suggestion index, each worker builds its own copy on first use and
+rebuilds it in a background thread once it is older than `ttl` seconds.
+Until then, new venues and artists are not offered as candidates, but
+they can be queried for matches.
+"""
+import threading
+import time
+
+import numpy as np
+
+# Weights of each signal in the final score; a perfect match scores 1.
+GENRE_WEIGHT = 0.5
+CITY_WEIGHT = 0.25
+STATE_WEIGHT = 0.1
+HISTORY_WEIGHT = 0.15
+EXPERIENCE_WEIGHT = 0.1
+
+# Shows played together at which the history signal is at its maximum.
+HISTORY_SATURATION = 3
+
+# The other side each kind is matched against.
+OTHER_SIDE = {'venues': 'artists', 'artists': 'venues'}
+
+
+class Side:
+    """Features of every venue or every artist, one row per entity."""
+
+    def __init__(self, rows, genres, areas):
+        # rows: (id, name, city, state, genres, seeking, past_shows_count)
+        # tuples. `genres` and `areas` map names to column / code numbers
+        # shared by both sides, and grow as new ones are seen.
+        count = len(rows)
+        self.ids = np.empty(count, dtype=np.int64)
+        self.names = []
+        self.cities = []
+        self.states = []
+        self.city_codes = np.empty(count, dtype=np.int32)
+        self.state_codes = np.empty(count, dtype=np.int32)
+        self.seeking = np.empty(count, dtype=bool)
+        past_shows = np.empty(count, dtype=np.float32)
+        tags = []
+        codes = {}
+        for i, (id, name, city, state, entity_genres, seeking, past) in enumerate(rows):
+            self.ids[i] = id
+            self.names.append(name)
+            self.cities.append(city)
+            self.states.append(state)
+            if (city, state) not in codes:
+                codes[city, state] = (
+                    areas.setdefault(area_key(city, state), len(areas)),
+                    areas.setdefault(area_key(None, state), len(areas)))
+            self.city_codes[i], self.state_codes[i] = codes[city, state]
+            self.seeking[i] = bool(seeking)
+            past_shows[i] = past or 0
+            tags.extend((i, genres.setdefault(genre, len(genres))) for genre in set(entity_genres or ()))
+        self.position = {int(id): i for i, id in enumerate(self.ids)}
+        self._tags = tags
+
+        top = past_shows.max() if count else 0
+        self.experience = np.log1p(past_shows) / np.log1p(top) if top else np.zeros(count, dtype=np.float32)
+
+    def rows_of(self, ids):
+        """Row of each id in the `ids` array, or -1 for unknown ids."""
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        order = np.argsort(self.ids)
+        rows = order[np.searchsorted(self.ids, ids, sorter=order).clip(max=len(order) - 1)]
+        return np.where(self.ids[rows] == ids, rows, -1)
+
+    def finish(self, genre_count):
+        # The genre matrix is built once both sides have added their genres
+        # to the shared vocabulary, with unit-length rows.
+        self.genres = np.zeros((len(self.ids), genre_count), dtype=np.float32)
+        if self._tags:
+            rows, columns = np.array(self._tags, dtype=np.int64).T
+            self.genres[rows, columns] = 1.0
+        norms = np.linalg.norm(self.genres, axis=1, keepdims=True)
+        np.divide(self.genres, norms, out=self.genres, where=norms > 0)
+        del self._tags
+
+
+class ShowPairs:
+    """Shows played together, from one side's row to the other side's rows."""
+
+    def __init__(self, sources, targets, counts, size):
+        order = np.argsort(sources, kind='stable')
+        self.offsets = np.searchsorted(sources[order], np.arange(size + 1))
+        self.targets = targets[order]
+        self.counts = counts[order]
+
+    def of(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.targets[start:end], self.counts[start:end]
+
+
+def area_key(city, state):
+    return ((city or '').strip().lower(), (state or '').strip().upper())
+
+
+class MatchData:
+
+    def __init__(self, venues, artists, shows):
+        self.genres = {}
+        self.areas = {}
+        self.sides = {
+            'venues': Side(venues, self.genres, self.areas),
+            'artists': Side(artists, self.genres, self.areas),
+        }
+        for side in self.sides.values():
+            side.finish(len(self.genres))
+
+        # shows: (venue_id, artist_id) for every show; repeated pairs are
+        # counted here rather than grouped by the database.
+        venue_ids, artist_ids = (np.array(column, dtype=np.int64) for column in zip(*shows)) if shows else (
+            np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        venue_rows = self.sides['venues'].rows_of(venue_ids)
+        artist_rows = self.sides['artists'].rows_of(artist_ids)
+        known = (venue_rows >= 0) & (artist_rows >= 0)
+        artist_count = len(self.sides['artists'].ids)
+        pairs, counts = np.unique(venue_rows[known] * artist_count + artist_rows[known], return_counts=True)
+        venue_rows, artist_rows = np.divmod(pairs, artist_count)
+        counts = counts.astype(np.float32)
+        self.pairs = {
+            'venues': ShowPairs(venue_rows, artist_rows, counts, len(self.sides['venues'].ids)),
+            'artists': ShowPairs(artist_rows, venue_rows, counts, artist_count),
+        }
+
+    def genre_vector(self, genres):
+        vector = np.zeros(len(self.genres), dtype=np.float32)
+        for genre in set(genres or ()):
+            if genre in self.genres:
+                vector[self.genres[genre]] = 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def matches(self, kind, entity, limit):
+        candidates = self.sides[OTHER_SIDE[kind]]
+        if not len(candidates.ids):
+            return []
+
+        genre_score = candidates.genres @ self.genre_vector(entity.genres)
+        # Entities without a city or state are not near anyone.
+        city = self.areas.get(area_key(entity.city, entity.state), -1) if entity.city and entity.state else -1
+        state = self.areas.get(area_key(None, entity.state), -1) if entity.state else -1
+        same_city = candidates.city_codes == city
+        same_state = candidates.state_codes == state
+        shows_together = np.zeros(len(candidates.ids), dtype=np.float32)
+        row = self.sides[kind].position.get(entity.id)
+        if row is not None:
+            targets, counts = self.pairs[kind].of(row)
+            shows_together[targets] = counts
+
+        scores = (
+            GENRE_WEIGHT * genre_score
+            + CITY_WEIGHT * same_city
+            + STATE_WEIGHT * (same_state & ~same_city)
+            + HISTORY_WEIGHT * np.minimum(shows_together / HISTORY_SATURATION, 1.0)
+            + EXPERIENCE_WEIGHT * candidates.experience
+        )
+        scores[~candidates.seeking] = -np.inf
+
+        k = min(limit, int(candidates.seeking.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((candidates.ids[top], -scores[top]))]
+        return [{
+            'id': int(candidates.ids[i]),
+            'name': candidates.names[i],
+            'city': candidates.cities[i],
+            'state': candidates.states[i],
+            'score': round(float(scores[i]), 4),
+            'genre_overlap': round(float(genre_score[i]), 4),
+            'same_city': bool(same_city[i]),
+            'same_state': bool(same_state[i]),
+            'shows_together': int(shows_together[i]),
+        } for i in top]
+
+
+class MatchIndex:
+
+    def __init__(self, loader, ttl=300):
+        # loader() returns (venues, artists, shows) rows; see MatchData.
+        self._loader = loader
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._data = None
+        self._built_at = None
+        self._rebuilding = False
+
+    def build(self):
+        try:
+            data = MatchData(*self._loader())
+        finally:
+            with self._lock:
+                self._rebuilding = False
+        with self._lock:
+            self._data = data
+            self._built_at = time.monotonic()
+
+    def _ensure_built(self):
+        if self._built_at is None:
+            self.build()
+        elif time.monotonic() - self._built_at > self._ttl and not self._rebuilding:
+            # Keep answering from the current matrices while new ones load.
+            self._rebuilding = True
+            threading.Thread(target=self.build, daemon=True).start()
+
+    def matches(self, kind, entity, limit=10):
+        """Best `limit` candidates for `entity`, a venue or artist per `kind`.
+
+        `entity` needs id, genres, city and state attributes.
+        """
+        self._ensure_built()
+        return self._data.matches(kind, entity, limit)
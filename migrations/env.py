@@ -4,6 +4,8 @@ import logging
 from logging.config import fileConfig
 
 from flask import current_app
+from sqlalchemy import ARRAY
+from sqlalchemy.ext.compiler import compiles
 
 from alembic import context
 
@@ -16,6 +18,14 @@ config = context.config
 fileConfig(config.config_file_name)
 logger = logging.getLogger('alembic.env')
 
+
+# The base migration declares genres as ARRAY, which only PostgreSQL has.
+# Elsewhere (local SQLite) they are stored as JSON lists, like GenreList in
+# models.py does, so the revisions run unchanged on both.
+@compiles(ARRAY, 'sqlite')
+def compile_array_as_json(type_, compiler, **kw):
+    return 'JSON'
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
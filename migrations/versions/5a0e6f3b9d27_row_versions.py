@@ -0,0 +1,35 @@
+"""row versions
+
+Revision ID: 5a0e6f3b9d27
+Revises: d5c83a7e2b19
+Create Date: 2026-10-18 13:02:44.561093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a0e6f3b9d27'
+down_revision = 'd5c83a7e2b19'
+branch_labels = None
+depends_on = None
+
+TABLES = ('venues', 'artists', 'shows')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=True))
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute("UPDATE {} SET version = 1, updated_at = CURRENT_TIMESTAMP".format(table))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('version', existing_type=sa.Integer(), nullable=False)
+            batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('updated_at')
+            batch_op.drop_column('version')
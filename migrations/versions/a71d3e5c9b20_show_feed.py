@@ -0,0 +1,58 @@
+"""show feed
+
+Revision ID: a71d3e5c9b20
+Revises: f4a8c2e61b07
+Create Date: 2026-10-18 17:42:03.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a71d3e5c9b20'
+down_revision = 'f4a8c2e61b07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_feed',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('venue_name', sa.String(), nullable=True),
+    sa.Column('venue_address', sa.String(length=120), nullable=True),
+    sa.Column('venue_city', sa.String(length=120), nullable=True),
+    sa.Column('venue_state', sa.String(length=120), nullable=True),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('artist_name', sa.String(), nullable=True),
+    sa.Column('artist_image_link', sa.String(length=500), nullable=True),
+    sa.Column('artist_genres', sa.ARRAY(sa.String()).with_variant(sa.JSON(), 'sqlite'), nullable=True),
+    sa.ForeignKeyConstraint(['id'], ['shows.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_show_feed_start_time_id', 'show_feed', ['start_time', 'id'], unique=False)
+    op.create_index('ix_show_feed_area_start_time', 'show_feed', ['venue_state', 'venue_city', 'start_time'], unique=False)
+    op.create_index('ix_show_feed_venue_id_start_time', 'show_feed', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_show_feed_artist_id_start_time', 'show_feed', ['artist_id', 'start_time'], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.create_index('ix_show_feed_artist_genres', 'show_feed', ['artist_genres'], unique=False, postgresql_using='gin')
+
+    op.execute(
+        'INSERT INTO show_feed (id, start_time, venue_id, venue_name, venue_address, venue_city, venue_state, '
+        'artist_id, artist_name, artist_image_link, artist_genres) '
+        'SELECT shows.id, shows.start_time, shows.venue_id, venues.name, venues.address, venues.city, venues.state, '
+        'shows.artist_id, artists.name, artists.image_link, artists.genres '
+        'FROM shows JOIN venues ON shows.venue_id = venues.id JOIN artists ON shows.artist_id = artists.id'
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_show_feed_artist_genres', table_name='show_feed')
+    op.drop_index('ix_show_feed_artist_id_start_time', table_name='show_feed')
+    op.drop_index('ix_show_feed_venue_id_start_time', table_name='show_feed')
+    op.drop_index('ix_show_feed_area_start_time', table_name='show_feed')
+    op.drop_index('ix_show_feed_start_time_id', table_name='show_feed')
+    op.drop_table('show_feed')
@@ -0,0 +1,58 @@
+"""show end time
+
+Revision ID: b6d94f1e3a58
+Revises: c28e4b7a1f93
+Create Date: 2026-10-18 21:06:47.390517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d94f1e3a58'
+down_revision = 'c28e4b7a1f93'
+branch_labels = None
+depends_on = None
+
+# Length given to existing shows, the SHOW_DURATION_MINUTES default.
+DURATION_MINUTES = 120
+
+
+def end_time(dialect_name, column):
+    if dialect_name == 'sqlite':
+        # Keep the fraction of a second as written, so that start and end
+        # times still compare correctly as strings.
+        return "strftime('%Y-%m-%d %H:%M:%S', {0}, '+{1} minutes') || substr({0}, 20)".format(
+            column, DURATION_MINUTES)
+    return "{} + interval '{} minutes'".format(column, DURATION_MINUTES)
+
+
+def upgrade():
+    dialect_name = op.get_bind().dialect.name
+    for table in ('shows', 'show_feed'):
+        op.add_column(table, sa.Column('end_time', sa.DateTime(), nullable=True))
+        op.execute('UPDATE {} SET end_time = {}'.format(table, end_time(dialect_name, 'start_time')))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    if dialect_name == 'postgresql':
+        # Deferred to commit, so a batch can be inserted and checked for
+        # overlaps as a whole before anything is refused. Creating them
+        # fails if existing shows already overlap.
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for key in ('venue_id', 'artist_id'):
+            op.create_exclude_constraint(
+                'shows_{}_no_overlap'.format(key.split('_')[0]), 'shows',
+                (key, '='), (sa.text('tsrange(start_time, end_time)'), '&&'),
+                using='gist', deferrable=True, initially='DEFERRED'
+            )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_constraint('shows_artist_no_overlap', 'shows')
+        op.drop_constraint('shows_venue_no_overlap', 'shows')
+    for table in ('show_feed', 'shows'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('end_time')
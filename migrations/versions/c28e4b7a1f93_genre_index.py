@@ -0,0 +1,59 @@
+"""genre index
+
+Revision ID: c28e4b7a1f93
+Revises: a71d3e5c9b20
+Create Date: 2026-10-18 19:10:47.306185
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c28e4b7a1f93'
+down_revision = 'a71d3e5c9b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('genre_counts',
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('genre', sa.String(length=120), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'genre')
+    )
+    # The GIN indexes on venues.genres and artists.genres come from the
+    # search trigram indexes revision.
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    if not postgres:
+        op.create_table('genre_tags',
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('genre', sa.String(length=120), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'genre', 'entity_id')
+        )
+        op.create_index('ix_genre_tags_kind_entity_id', 'genre_tags', ['kind', 'entity_id'], unique=False)
+
+    for table in ('venues', 'artists'):
+        if postgres:
+            tags, genre = 'unnest({}.genres) AS tag(genre)'.format(table), 'tag.genre'
+        else:
+            tags, genre = 'json_each({}.genres) AS tag'.format(table), 'tag.value'
+            op.execute(
+                "INSERT INTO genre_tags (kind, genre, entity_id) "
+                "SELECT DISTINCT '{table}', {genre}, {table}.id FROM {table}, {tags}"
+                .format(table=table, genre=genre, tags=tags)
+            )
+        op.execute(
+            "INSERT INTO genre_counts (kind, genre, count) "
+            "SELECT '{table}', {genre}, count(DISTINCT {table}.id) FROM {table}, {tags} GROUP BY {genre}"
+            .format(table=table, genre=genre, tags=tags)
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        op.drop_index('ix_genre_tags_kind_entity_id', table_name='genre_tags')
+        op.drop_table('genre_tags')
+    op.drop_table('genre_counts')
@@ -0,0 +1,44 @@
+"""search trigram indexes
+
+Revision ID: d5c83a7e2b19
+Revises: b47d0e9c1f35
+Create Date: 2026-10-18 11:26:08.417733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5c83a7e2b19'
+down_revision = 'b47d0e9c1f35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # pg_trgm and GIN only exist on PostgreSQL; other backends fall back to
+    # LIKE matching in search.py and need no extra indexes.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('venues', 'artists'):
+        for column in ('name', 'city'):
+            op.create_index(
+                'ix_{}_{}_trgm'.format(table, column), table, [column],
+                unique=False, postgresql_using='gin',
+                postgresql_ops={column: 'gin_trgm_ops'}
+            )
+        op.create_index(
+            'ix_{}_genres'.format(table), table, ['genres'],
+            unique=False, postgresql_using='gin'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table in ('venues', 'artists'):
+        op.drop_index('ix_{}_genres'.format(table), table_name=table)
+        for column in ('name', 'city'):
+            op.drop_index('ix_{}_{}_trgm'.format(table, column), table_name=table)
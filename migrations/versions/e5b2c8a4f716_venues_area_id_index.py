@@ -0,0 +1,27 @@
+"""venues area id index
+
+Revision ID: e5b2c8a4f716
+Revises: b6d94f1e3a58
+Create Date: 2026-10-18 23:12:40.118263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2c8a4f716'
+down_revision = 'b6d94f1e3a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The venues listing pages by (state, city, id).
+    op.create_index('ix_venues_state_city_id', 'venues', ['state', 'city', 'id'], unique=False)
+    op.drop_index('ix_venues_state_city', table_name='venues')
+
+
+def downgrade():
+    op.create_index('ix_venues_state_city', 'venues', ['state', 'city'], unique=False)
+    op.drop_index('ix_venues_state_city_id', table_name='venues')
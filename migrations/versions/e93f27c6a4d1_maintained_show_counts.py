@@ -0,0 +1,46 @@
+"""maintained show counts
+
+Revision ID: e93f27c6a4d1
+Revises: 5a0e6f3b9d27
+Create Date: 2026-10-18 14:20:31.774902
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e93f27c6a4d1'
+down_revision = '5a0e6f3b9d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('shows', sa.Column('is_upcoming', sa.Boolean(), nullable=True))
+    op.execute(
+        sa.text('UPDATE shows SET is_upcoming = (start_time > :now)').bindparams(now=datetime.now())
+    )
+    with op.batch_alter_table('shows') as batch_op:
+        batch_op.alter_column('is_upcoming', existing_type=sa.Boolean(), nullable=False)
+    op.create_index(
+        'ix_shows_upcoming_start_time', 'shows', ['start_time'], unique=False,
+        postgresql_where=sa.text('is_upcoming'), sqlite_where=sa.text('is_upcoming')
+    )
+
+    # Backfill the counters that were never maintained before.
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.execute(
+            'UPDATE {table} SET '
+            'upcoming_shows_count = (SELECT count(*) FROM shows WHERE shows.{key} = {table}.id AND shows.is_upcoming), '
+            'past_shows_count = (SELECT count(*) FROM shows WHERE shows.{key} = {table}.id AND NOT shows.is_upcoming)'
+            .format(table=table, key=key)
+        )
+
+
+def downgrade():
+    op.drop_index('ix_shows_upcoming_start_time', table_name='shows')
+    with op.batch_alter_table('shows') as batch_op:
+        batch_op.drop_column('is_upcoming')
@@ -0,0 +1,461 @@
+#----------------------------------------------------------------------------#
+# Imports
+#----------------------------------------------------------------------------#
+
+from datetime import datetime, timedelta
+from collections import Counter
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.types import TypeDecorator
+import routing
+
+# Bound to an application by create_app(); the schema itself is managed by
+# the Alembic migrations in migrations/.
+db = routing.RoutingSQLAlchemy()
+
+#----------------------------------------------------------------------------#
+# Models.
+#----------------------------------------------------------------------------#
+
+class GenreList(TypeDecorator):
+    # ARRAY(String) on PostgreSQL, a JSON list elsewhere (e.g. local SQLite).
+    impl = db.JSON
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+      if dialect.name == 'postgresql':
+        return dialect.type_descriptor(db.ARRAY(db.String))
+      return dialect.type_descriptor(db.JSON())
+
+class Venue(db.Model):
+    __tablename__ = 'venues'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    # The previous genres are loaded before an update, for the genre index.
+    genres = db.column_property(db.Column(GenreList), active_history=True)
+    address = db.Column(db.String(120))
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    website_link = db.Column(db.String(120))
+    facebook_link = db.Column(db.String(120))
+    seeking_talent = db.Column(db.Boolean)
+    seeking_description = db.Column(db.String(150))
+    image_link = db.Column(db.String(500))
+    past_shows_count = db.Column(db.Integer, default=0)
+    upcoming_shows_count = db.Column(db.Integer, default=0)
+    shows = db.relationship('Show', backref='venue', lazy=True, cascade='all, delete')
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __mapper_args__ = {'version_id_col': version}
+
+    __table_args__ = (
+      db.Index('ix_venues_state_city_id', 'state', 'city', 'id'),
+      db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+      db.Index('ix_venues_city_trgm', 'city', postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'}),
+      db.Index('ix_venues_genres', 'genres', postgresql_using='gin'),
+    )
+
+    def toDict(self):
+       return dict(id=self.id, name=self.name)
+
+class Artist(db.Model):
+    __tablename__ = 'artists'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String)
+    # The previous genres are loaded before an update, for the genre index.
+    genres = db.column_property(db.Column(GenreList), active_history=True)
+    city = db.Column(db.String(120))
+    state = db.Column(db.String(120))
+    phone = db.Column(db.String(120))
+    website_link = db.Column(db.String(120))
+    facebook_link = db.Column(db.String(120))
+    seeking_venue = db.Column(db.Boolean)
+    seeking_description = db.Column(db.String(150))
+    image_link = db.Column(db.String(500))
+    past_shows_count = db.Column(db.Integer, default=0)
+    upcoming_shows_count = db.Column(db.Integer, default=0)
+    shows = db.relationship('Show', backref='artist', lazy=True, cascade='all, delete')
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __mapper_args__ = {'version_id_col': version}
+
+    __table_args__ = (
+      db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+      db.Index('ix_artists_city_trgm', 'city', postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'}),
+      db.Index('ix_artists_genres', 'genres', postgresql_using='gin'),
+    )
+    
+    def toDict(self):
+       return dict(id=self.id, name=self.name)
+
+class Show(db.Model):
+    __tablename__ = 'shows'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # The previous venue and artist are loaded before an update, for the
+    # show counters.
+    artist_id = db.column_property(db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE')), active_history=True)
+    venue_id = db.column_property(db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE')), active_history=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    # Whether the show is currently counted in upcoming_shows_count rather
+    # than past_shows_count of its venue and artist.
+    is_upcoming = db.Column(db.Boolean, nullable=False, default=False)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __mapper_args__ = {'version_id_col': version}
+
+    __table_args__ = (
+      db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+      db.Index('ix_shows_start_time_brin', 'start_time', postgresql_using='brin'),
+      db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+      db.Index('ix_shows_upcoming_start_time', 'start_time',
+        postgresql_where=db.text('is_upcoming'), sqlite_where=db.text('is_upcoming')),
+      # On PostgreSQL the shows_*_no_overlap exclusion constraints (see the
+      # show_end_time migration) also keep venue and artist bookings apart;
+      # they cannot be declared here without breaking other dialects' DDL.
+    )
+
+    def toDict(self):
+       return dict(id=self.id, artist_id=self.artist_id, venue_id=self.venue_id)
+
+class ShowFeed(db.Model):
+    # One row per show with the venue and artist fields the listings need,
+    # so they read a single table. Maintained below; never written directly.
+    __tablename__ = 'show_feed'
+
+    id = db.Column(db.Integer, db.ForeignKey('shows.id', ondelete='CASCADE'), primary_key=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    venue_id = db.Column(db.Integer, nullable=False)
+    venue_name = db.Column(db.String)
+    venue_address = db.Column(db.String(120))
+    venue_city = db.Column(db.String(120))
+    venue_state = db.Column(db.String(120))
+    artist_id = db.Column(db.Integer, nullable=False)
+    artist_name = db.Column(db.String)
+    artist_image_link = db.Column(db.String(500))
+    artist_genres = db.Column(GenreList)
+
+    __table_args__ = (
+      db.Index('ix_show_feed_start_time_id', 'start_time', 'id'),
+      db.Index('ix_show_feed_area_start_time', 'venue_state', 'venue_city', 'start_time'),
+      db.Index('ix_show_feed_venue_id_start_time', 'venue_id', 'start_time'),
+      db.Index('ix_show_feed_artist_id_start_time', 'artist_id', 'start_time'),
+      db.Index('ix_show_feed_artist_genres', 'artist_genres', postgresql_using='gin'),
+    )
+
+class GenreCount(db.Model):
+    # Venues or artists (`kind`) tagged with each genre, for the genre
+    # filters' facet counts. Maintained below.
+    __tablename__ = 'genre_counts'
+
+    kind = db.Column(db.String(20), primary_key=True)
+    genre = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class GenreTag(db.Model):
+    # One row per genre of each venue or artist. PostgreSQL filters on the
+    # GIN-indexed genres arrays instead, so this is only kept elsewhere
+    # (SQLite), where the JSON lists cannot be indexed.
+    __tablename__ = 'genre_tags'
+
+    kind = db.Column(db.String(20), primary_key=True)
+    genre = db.Column(db.String(120), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+
+    __table_args__ = (
+      db.Index('ix_genre_tags_kind_entity_id', 'kind', 'entity_id'),
+    )
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# past_shows_count / upcoming_shows_count on venues and artists are kept in
+# step with the shows table: every insert, delete or move of a show is noted
+# as it is flushed, and the counters are adjusted together at the end of the
+# flush, with one statement per table however many shows it wrote.
+# rollover_shows() periodically moves shows whose start_time has passed from
+# the upcoming to the past column.
+
+def show_count_deltas(shows, sign=1, deltas=None):
+  # shows: (venue_id, artist_id, is_upcoming) tuples.
+  deltas = deltas if deltas is not None else {Venue: {}, Artist: {}}
+  for venue_id, artist_id, is_upcoming in shows:
+    for model, entity_id in ((Venue, venue_id), (Artist, artist_id)):
+      if entity_id is None:
+        continue
+      past, upcoming = deltas[model].get(entity_id, (0, 0))
+      if is_upcoming:
+        upcoming += sign
+      else:
+        past += sign
+      deltas[model][entity_id] = (past, upcoming)
+  return deltas
+
+def adjust_show_counts(connection, deltas):
+  for model, by_id in deltas.items():
+    params = [{'entity_id': entity_id, 'past': past, 'upcoming': upcoming}
+      for entity_id, (past, upcoming) in by_id.items() if past or upcoming]
+    if not params:
+      continue
+    table = model.__table__
+    connection.execute(
+      table.update().where(table.c.id == db.bindparam('entity_id')).values(
+        past_shows_count=db.func.coalesce(table.c.past_shows_count, 0) + db.bindparam('past'),
+        upcoming_shows_count=db.func.coalesce(table.c.upcoming_shows_count, 0) + db.bindparam('upcoming')
+      ),
+      params
+    )
+
+def flushed_show_counts(show):
+  # Deltas of the flush `show` is part of, applied by apply_show_counts().
+  info = db.inspect(show).session.info
+  return info.setdefault('show_count_deltas', {Venue: {}, Artist: {}})
+
+@db.event.listens_for(Show, 'before_insert')
+def show_before_insert(mapper, connection, show):
+  show.is_upcoming = show.start_time > datetime.now()
+  if show.end_time is None:
+    show.end_time = show.start_time + timedelta(minutes=current_app.config['SHOW_DURATION_MINUTES'])
+
+@db.event.listens_for(Show, 'after_insert')
+def show_after_insert(mapper, connection, show):
+  show_count_deltas([(show.venue_id, show.artist_id, show.is_upcoming)], deltas=flushed_show_counts(show))
+
+@db.event.listens_for(Show, 'after_delete')
+def show_after_delete(mapper, connection, show):
+  show_count_deltas([(show.venue_id, show.artist_id, show.is_upcoming)], sign=-1, deltas=flushed_show_counts(show))
+
+@db.event.listens_for(Show, 'before_update')
+def show_before_update(mapper, connection, show):
+  state = db.inspect(show)
+  if not any(state.attrs[key].history.has_changes() for key in ('venue_id', 'artist_id', 'start_time')):
+    return
+  def previous(key):
+    history = state.attrs[key].history
+    return history.deleted[0] if history.deleted else getattr(show, key)
+  old = (previous('venue_id'), previous('artist_id'), previous('is_upcoming'))
+  show.is_upcoming = show.start_time > datetime.now()
+  deltas = flushed_show_counts(show)
+  show_count_deltas([old], sign=-1, deltas=deltas)
+  show_count_deltas([(show.venue_id, show.artist_id, show.is_upcoming)], deltas=deltas)
+
+@db.event.listens_for(routing.RoutingSession, 'after_flush')
+def apply_show_counts(session, flush_context):
+  deltas = session.info.pop('show_count_deltas', None)
+  if not deltas:
+    return
+  # Venues and artists deleted in this flush took their counters with them.
+  for target in session.deleted:
+    deltas.get(type(target), {}).pop(target.id, None)
+  adjust_show_counts(session.connection(), deltas)
+
+@db.event.listens_for(routing.RoutingSession, 'after_soft_rollback')
+def discard_show_counts(session, previous_transaction):
+  # A flush that failed part way leaves the deltas of what it had written.
+  session.info.pop('show_count_deltas', None)
+
+def rollover_shows(connection, now=None):
+  # Move every show that has started since the last run from upcoming to
+  # past, in bulk. Returns the number of shows moved.
+  now = now or datetime.now()
+  started = db.and_(Show.is_upcoming == True, Show.start_time <= now)
+  update = Show.__table__.update().where(started).values(is_upcoming=False)
+  if connection.dialect.full_returning:
+    # Flag and collect the moved shows in one statement so a concurrent
+    # delete cannot slip in between.
+    moved = [(venue_id, artist_id, 1) for venue_id, artist_id
+      in connection.execute(update.returning(Show.venue_id, Show.artist_id))]
+  else:
+    moved = connection.execute(
+      db.select(Show.venue_id, Show.artist_id, db.func.count(Show.id))
+        .where(started).group_by(Show.venue_id, Show.artist_id)
+    ).all()
+    connection.execute(update)
+
+  deltas = {Venue: {}, Artist: {}}
+  for venue_id, artist_id, count in moved:
+    for model, entity_id in ((Venue, venue_id), (Artist, artist_id)):
+      if entity_id is None:
+        continue
+      past, upcoming = deltas[model].get(entity_id, (0, 0))
+      deltas[model][entity_id] = (past + count, upcoming - count)
+  adjust_show_counts(connection, deltas)
+  return sum(count for _, _, count in moved)
+
+#----------------------------------------------------------------------------#
+# Show feed.
+#----------------------------------------------------------------------------#
+
+# show_feed copies venue and artist fields next to each show. Show writes
+# rebuild their own row in the same flush, and venue or artist edits update
+# the rows of their shows. Bulk loads that bypass the ORM call
+# refresh_show_feed() themselves.
+
+FEED_VENUE_FIELDS = {'name': 'venue_name', 'address': 'venue_address', 'city': 'venue_city', 'state': 'venue_state'}
+FEED_ARTIST_FIELDS = {'name': 'artist_name', 'image_link': 'artist_image_link', 'genres': 'artist_genres'}
+
+def show_feed_select():
+  return db.select(
+    Show.id,
+    Show.start_time,
+    Show.end_time,
+    Show.venue_id,
+    Venue.name,
+    Venue.address,
+    Venue.city,
+    Venue.state,
+    Show.artist_id,
+    Artist.name,
+    Artist.image_link,
+    Artist.genres
+  ).join(Venue, Show.venue_id == Venue.id).join(Artist, Show.artist_id == Artist.id)
+
+def refresh_show_feed(connection, criterion=None):
+  # Rebuild the feed rows of the shows matching `criterion`, or of every
+  # show when it is None.
+  feed = ShowFeed.__table__
+  select = show_feed_select()
+  delete = feed.delete()
+  if criterion is not None:
+    select = select.where(criterion)
+    delete = delete.where(feed.c.id.in_(db.select(Show.id).where(criterion)))
+  connection.execute(delete)
+  columns = ['id', 'start_time', 'end_time', 'venue_id', 'venue_name', 'venue_address', 'venue_city', 'venue_state',
+    'artist_id', 'artist_name', 'artist_image_link', 'artist_genres']
+  connection.execute(feed.insert().from_select(columns, select))
+
+def changed_fields(target, fields):
+  state = db.inspect(target)
+  return {column: getattr(target, key) for key, column in fields.items() if state.attrs[key].history.has_changes()}
+
+@db.event.listens_for(Show, 'after_insert')
+def show_feed_after_insert(mapper, connection, show):
+  refresh_show_feed(connection, Show.id == show.id)
+
+@db.event.listens_for(Show, 'after_update')
+def show_feed_after_update(mapper, connection, show):
+  state = db.inspect(show)
+  if any(state.attrs[key].history.has_changes() for key in ('venue_id', 'artist_id', 'start_time', 'end_time')):
+    refresh_show_feed(connection, Show.id == show.id)
+
+@db.event.listens_for(Show, 'after_delete')
+def show_feed_after_delete(mapper, connection, show):
+  # Covers backends that do not enforce the ON DELETE CASCADE. The rows go
+  # in one statement at the end of the flush (delete_feed_rows).
+  db.inspect(show).session.info.setdefault('deleted_show_ids', set()).add(show.id)
+
+@db.event.listens_for(routing.RoutingSession, 'after_flush')
+def delete_feed_rows(session, flush_context):
+  show_ids = session.info.pop('deleted_show_ids', None)
+  if show_ids:
+    session.connection().execute(ShowFeed.__table__.delete().where(ShowFeed.id.in_(show_ids)))
+
+@db.event.listens_for(routing.RoutingSession, 'after_soft_rollback')
+def discard_feed_rows(session, previous_transaction):
+  session.info.pop('deleted_show_ids', None)
+
+@db.event.listens_for(Venue, 'after_update')
+def show_feed_venue_after_update(mapper, connection, venue):
+  values = changed_fields(venue, FEED_VENUE_FIELDS)
+  if values:
+    connection.execute(ShowFeed.__table__.update().where(ShowFeed.venue_id == venue.id).values(**values))
+
+@db.event.listens_for(Artist, 'after_update')
+def show_feed_artist_after_update(mapper, connection, artist):
+  values = changed_fields(artist, FEED_ARTIST_FIELDS)
+  if values:
+    connection.execute(ShowFeed.__table__.update().where(ShowFeed.artist_id == artist.id).values(**values))
+
+#----------------------------------------------------------------------------#
+# Genre index.
+#----------------------------------------------------------------------------#
+
+# genre_counts (and genre_tags outside PostgreSQL) follow the genres of
+# venues and artists: inserts, edits and deletes adjust them in the same
+# flush. Bulk loads that bypass the ORM call index_genres() themselves.
+
+GENRE_KINDS = {Venue: 'venues', Artist: 'artists'}
+
+def upsert(connection, table):
+  dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+  return dialect.insert(table)
+
+def adjust_genres(connection, kind, added, removed):
+  # added / removed: (entity_id, genre) pairs.
+  counts = Counter(genre for _, genre in added)
+  counts.subtract(genre for _, genre in removed)
+  params = [{'kind': kind, 'genre': genre, 'delta': delta} for genre, delta in counts.items() if delta]
+  if params:
+    table = GenreCount.__table__
+    insert = upsert(connection, table).values(kind=db.bindparam('kind'), genre=db.bindparam('genre'), count=db.bindparam('delta'))
+    connection.execute(insert.on_conflict_do_update(
+      index_elements=[table.c.kind, table.c.genre],
+      set_={'count': table.c.count + insert.excluded['count']}
+    ), params)
+
+  if connection.dialect.name == 'postgresql':
+    return
+  tags = GenreTag.__table__
+  if removed:
+    connection.execute(tags.delete().where(db.and_(
+      tags.c.kind == kind, tags.c.entity_id == db.bindparam('entity'), tags.c.genre == db.bindparam('name')
+    )), [{'entity': entity_id, 'name': genre} for entity_id, genre in removed])
+  if added:
+    connection.execute(tags.insert(), [{'kind': kind, 'entity_id': entity_id, 'genre': genre} for entity_id, genre in added])
+
+def genre_pairs(entity_id, genres):
+  return [(entity_id, genre) for genre in set(genres or ())]
+
+def index_genres(connection, model, criterion=None):
+  # Add the genres of the rows of `model` matching `criterion` (all rows
+  # when None) that are not indexed yet, e.g. after a bulk insert.
+  select = db.select(model.id, model.genres)
+  if criterion is not None:
+    select = select.where(criterion)
+  added = [pair for entity_id, genres in connection.execute(select) for pair in genre_pairs(entity_id, genres)]
+  adjust_genres(connection, GENRE_KINDS[model], added, [])
+
+def genre_criterion(model, genres, match_all, dialect_name):
+  # Rows of `model` tagged with all (or any) of `genres`: the GIN-indexed
+  # @> / && operators on PostgreSQL, the genre_tags index elsewhere.
+  genres = list(genres)
+  if dialect_name == 'postgresql':
+    value = db.literal(genres, model.genres.type)
+    return model.genres.op('@>' if match_all else '&&')(value)
+  def tagged(*names):
+    return db.select(GenreTag.entity_id).where(GenreTag.kind == GENRE_KINDS[model], GenreTag.genre.in_(names))
+  if match_all and len(genres) > 1:
+    # One primary key range per genre, intersected.
+    return model.id.in_(db.intersect(*[tagged(genre) for genre in genres]))
+  return model.id.in_(tagged(*genres))
+
+@db.event.listens_for(Venue, 'after_insert')
+@db.event.listens_for(Artist, 'after_insert')
+def genres_after_insert(mapper, connection, target):
+  adjust_genres(connection, GENRE_KINDS[mapper.class_], genre_pairs(target.id, target.genres), [])
+
+@db.event.listens_for(Venue, 'after_update')
+@db.event.listens_for(Artist, 'after_update')
+def genres_after_update(mapper, connection, target):
+  history = db.inspect(target).attrs.genres.history
+  if not history.has_changes():
+    return
+  old = set(history.deleted[0] or ()) if history.deleted else set()
+  new = set(target.genres or ())
+  adjust_genres(connection, GENRE_KINDS[mapper.class_],
+    genre_pairs(target.id, new - old), genre_pairs(target.id, old - new))
+
+@db.event.listens_for(Venue, 'after_delete')
+@db.event.listens_for(Artist, 'after_delete')
+def genres_after_delete(mapper, connection, target):
+  adjust_genres(connection, GENRE_KINDS[mapper.class_], [], genre_pairs(target.id, target.genres))
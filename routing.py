@@ -0,0 +1,154 @@
+"""Send read-only requests to database replicas.
+
+Requests that cannot write (GET and HEAD, plus views marked with
+`read_only`) have their queries routed to the engines listed in
+SQLALCHEMY_REPLICA_URIS, picked round-robin. A replica that fails its health
+check is skipped for REPLICA_RETRY_SECONDS, and when none is available
+queries fall back to the primary.
+
+Writes always go to the primary. Once a session has flushed it stays on the
+primary for the rest of the request, and the client is pinned to the primary
+for REPLICA_PIN_SECONDS afterwards (via a cookie), so the page a form
+redirects to reads back what was just written even if the replicas lag.
+"""
+import functools
+import itertools
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.engine import make_url
+
+from instrumentation import UNCOUNTED
+
+PIN_COOKIE = 'db_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+def read_only(view):
+    """Mark a view that only reads (e.g. a search form posted with POST)."""
+    view._read_only = True
+    return view
+
+
+def wrote():
+    """Pin the client to the primary after writing outside the session."""
+    if has_request_context():
+        g.db_wrote = True
+
+
+class ReplicaSet:
+    """Round-robin over replica engines, skipping unhealthy ones."""
+
+    def __init__(self, engines, health_interval=10, retry_seconds=30):
+        self.engines = engines
+        self.health_interval = health_interval
+        self.retry_seconds = retry_seconds
+        self._lock = threading.Lock()
+        self._order = itertools.cycle(range(len(engines)))
+        self._checked_at = [None] * len(engines)
+        self._down_until = [0.0] * len(engines)
+
+    def pick(self):
+        """A healthy replica engine, or None when every replica is down."""
+        for _ in range(len(self.engines)):
+            with self._lock:
+                i = next(self._order)
+            if self._healthy(i):
+                return self.engines[i]
+        return None
+
+    def _healthy(self, i):
+        now = time.monotonic()
+        if self._down_until[i] > now:
+            return False
+        checked_at = self._checked_at[i]
+        if checked_at is not None and now - checked_at < self.health_interval:
+            return True
+        try:
+            with self.engines[i].connect() as connection:
+                connection.execution_options(**{UNCOUNTED: True}).execute(text('SELECT 1'))
+        except Exception:
+            self._down_until[i] = now + self.retry_seconds
+            current_app.logger.warning('Replica %s is unavailable', self.engines[i].url)
+            return False
+        self._checked_at[i] = now
+        return True
+
+    def status(self):
+        now = time.monotonic()
+        return [
+            {'url': engine.url.render_as_string(hide_password=True), 'up': self._down_until[i] <= now}
+            for i, engine in enumerate(self.engines)
+        ]
+
+    def dispose(self):
+        for engine in self.engines:
+            engine.dispose()
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if not self._flushing and not self.info.get('wrote') and _reads_from_replica():
+            replicas = self.app.extensions.get('replicas')
+            engine = replicas.pick() if replicas is not None else None
+            if engine is not None:
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _pin_to_primary(session, flush_context):
+    session.info['wrote'] = True
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _reads_from_replica():
+    return has_request_context() and g.get('db_read_only', False)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose sessions route reads to replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+        if not uris:
+            return
+
+        primary = make_url(app.config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+        engines = [
+            # Pool options only carry over to replicas on the same backend.
+            create_engine(uri, **(options if make_url(uri).get_backend_name() == primary else {}))
+            for uri in uris
+        ]
+        app.extensions['replicas'] = ReplicaSet(
+            engines,
+            health_interval=app.config.get('REPLICA_HEALTH_INTERVAL', 10),
+            retry_seconds=app.config.get('REPLICA_RETRY_SECONDS', 30),
+        )
+        app.before_request(_route_request)
+        app.after_request(functools.partial(_pin_client, app.config.get('REPLICA_PIN_SECONDS', 5)))
+
+
+def _route_request():
+    view = current_app.view_functions.get(request.endpoint)
+    pinned_until = request.cookies.get(PIN_COOKIE, 0, type=float)
+    g.db_read_only = (
+        (request.method in READ_METHODS or getattr(view, '_read_only', False))
+        and pinned_until < time.time()
+    )
+
+
+def _pin_client(seconds, response):
+    if g.get('db_wrote'):
+        response.set_cookie(PIN_COOKIE, str(time.time() + seconds), max_age=int(seconds) + 1, httponly=True)
+    return response
@@ -0,0 +1,115 @@
+"""Ranked fuzzy search over venues and artists.
+
+On PostgreSQL matching and ranking go through pg_trgm so the GIN trigram
+indexes on name/city and the GIN index on genres can be used. Any other
+backend (SQLite for local work) gets an equivalent LIKE-based path with a
+coarser ranking.
+"""
+from sqlalchemy import String, and_, case, func, literal, or_, select, type_coerce
+
+# Weights applied to each matching field when ranking results.
+NAME_WEIGHT = 1.0
+CITY_WEIGHT = 0.5
+STATE_WEIGHT = 0.3
+GENRE_WEIGHT = 0.4
+
+
+def split_term(term):
+    """Split "City, ST" style input into (term, state, state is required)."""
+    term = ' '.join(term.split())
+    if ',' in term:
+        city, state = term.rsplit(',', 1)
+        return city.strip(), state.strip().upper(), True
+    return term, term.upper(), False
+
+
+def matching_genres(term, vocabulary):
+    """Canonical genres from `vocabulary` that the search term refers to."""
+    needle = term.strip().lower()
+    if not needle:
+        return []
+    return [genre for genre in vocabulary if genre.lower().startswith(needle)]
+
+
+def _like(term, prefix=False):
+    escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%' if prefix else '%' + escaped + '%'
+
+
+def _combine(matches, state_match, state_required):
+    if state_required:
+        return and_(state_match, or_(*matches))
+    return or_(state_match, *matches)
+
+
+def genre_match(column, genres, dialect_name=None):
+    """Criterion for rows whose genre list `column` has any of `genres`."""
+    if dialect_name == 'postgresql':
+        return column.op('&&')(literal(list(genres), column.type))
+    # Genre lists are stored as JSON arrays of strings outside PostgreSQL.
+    stored = type_coerce(column, String)
+    return or_(*[stored.like('%"' + genre + '"%') for genre in genres])
+
+
+def _postgres_criteria(model, term, state, state_required, genres):
+    name_match = or_(model.name.ilike(_like(term), escape='\\'), model.name.op('%')(term))
+    city_match = or_(model.city.ilike(_like(term), escape='\\'), model.city.op('%')(term))
+    state_match = model.state == state
+    rank = (
+        func.similarity(model.name, term) * NAME_WEIGHT
+        + func.similarity(model.city, term) * CITY_WEIGHT
+        + case((state_match, STATE_WEIGHT), else_=0)
+    )
+    matches = [name_match, city_match]
+    if genres:
+        genres_matched = genre_match(model.genres, genres, 'postgresql')
+        rank = rank + case((genres_matched, GENRE_WEIGHT), else_=0)
+        matches.append(genres_matched)
+    return _combine(matches, state_match, state_required), rank
+
+
+def _fallback_criteria(model, term, state, state_required, genres):
+    name_rank = case(
+        (func.lower(model.name) == term.lower(), NAME_WEIGHT),
+        (model.name.ilike(_like(term, prefix=True), escape='\\'), NAME_WEIGHT * 0.8),
+        (model.name.ilike(_like(term), escape='\\'), NAME_WEIGHT * 0.6),
+        else_=0
+    )
+    city_rank = case((model.city.ilike(_like(term), escape='\\'), CITY_WEIGHT), else_=0)
+    state_match = model.state == state
+    rank = name_rank + city_rank + case((state_match, STATE_WEIGHT), else_=0)
+    matches = [name_rank > 0, city_rank > 0]
+    if genres:
+        genres_matched = genre_match(model.genres, genres)
+        rank = rank + case((genres_matched, GENRE_WEIGHT), else_=0)
+        matches.append(genres_matched)
+    return _combine(matches, state_match, state_required), rank
+
+
+def search_statement(model, term, dialect_name, genres=(), limit=20, offset=0):
+    """SELECT of the rows matching `term`, best match first.
+
+    Each row carries id, name, city, state, rank and the total number of
+    matches. `genres` are the canonical genre names the term should match
+    (see matching_genres). Returns None for a blank term.
+    """
+    term, state, state_required = split_term(term)
+    if not term:
+        return None
+
+    if dialect_name == 'postgresql':
+        criteria, rank = _postgres_criteria(model, term, state, state_required, list(genres))
+    else:
+        criteria, rank = _fallback_criteria(model, term, state, state_required, list(genres))
+
+    return select(
+        model.id,
+        model.name,
+        model.city,
+        model.state,
+        rank.label('rank'),
+        func.count().over().label('total')
+    ).where(criteria) \
+        .order_by(rank.desc(), model.name, model.id) \
+        .limit(limit).offset(offset)
+
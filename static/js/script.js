@@ -2,3 +2,29 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Navbar search autocomplete, answered by /api/suggest.
+document.addEventListener('DOMContentLoaded', function() {
+  var list = document.getElementById('search-suggestions');
+  var inputs = document.querySelectorAll('input[data-suggest]');
+  var pending = null;
+  Array.prototype.forEach.call(inputs, function(input) {
+    input.addEventListener('input', function() {
+      var q = input.value.trim();
+      if (pending) { pending.abort(); }
+      if (!q) { list.innerHTML = ''; return; }
+      pending = new XMLHttpRequest();
+      pending.open('GET', '/api/suggest?type=' + input.getAttribute('data-suggest') + '&q=' + encodeURIComponent(q));
+      pending.onload = function() {
+        if (this.status !== 200) { return; }
+        list.innerHTML = '';
+        JSON.parse(this.responseText).forEach(function(item) {
+          var option = document.createElement('option');
+          option.value = item.name;
+          list.appendChild(option);
+        });
+      };
+      pending.send();
+    });
+  });
+});
@@ -0,0 +1,118 @@
+"""In-process prefix index backing the /api/suggest autocomplete endpoint.
+
+Names are kept as a sorted list of (key, kind, id, name) tuples and looked
+up with bisect, so a query costs O(log n + k) and the index holds one small
+tuple per indexed word start. Each worker process keeps its own copy: it is
+updated in place by the handlers that write venues and artists and rebuilt
+from the database in a background thread once it is older than `ttl`
+seconds, so edits made in other workers are picked up eventually.
+"""
+import bisect
+import threading
+import time
+import unicodedata
+
+# Longest key kept per entry and most word starts indexed per name; together
+# they bound memory no matter how long the stored names are.
+MAX_KEY_LENGTH = 48
+MAX_WORDS = 4
+
+
+def normalize(text):
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def keys_for(name):
+    """Index keys for `name`: the full name and each later word start."""
+    words = normalize(name).split(' ')
+    return {' '.join(words[i:])[:MAX_KEY_LENGTH] for i in range(min(len(words), MAX_WORDS)) if words[i]}
+
+
+class PrefixIndex:
+
+    def __init__(self, loader, ttl=300):
+        # loader() yields (kind, id, name) for everything that should be indexed.
+        self._loader = loader
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = []
+        self._keys = {}
+        self._built_at = None
+        self._rebuilding = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def build(self):
+        entries = []
+        keys = {}
+        try:
+            for kind, id, name in self._loader():
+                entry_keys = keys_for(name)
+                keys[(kind, id)] = (name, entry_keys)
+                entries.extend((key, kind, id, name) for key in entry_keys)
+        finally:
+            # A failed load is retried on a later lookup.
+            with self._lock:
+                self._rebuilding = False
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._keys = keys
+            self._built_at = time.monotonic()
+
+    def _ensure_built(self):
+        if self._built_at is None:
+            self.build()
+        elif time.monotonic() - self._built_at > self._ttl and not self._rebuilding:
+            # Keep answering from the current entries while the new ones load.
+            self._rebuilding = True
+            threading.Thread(target=self.build, daemon=True).start()
+
+    def add(self, kind, id, name):
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._discard(kind, id)
+            entry_keys = keys_for(name)
+            self._keys[(kind, id)] = (name, entry_keys)
+            for key in entry_keys:
+                bisect.insort(self._entries, (key, kind, id, name))
+
+    def remove(self, kind, id):
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._discard(kind, id)
+
+    def _discard(self, kind, id):
+        name, entry_keys = self._keys.pop((kind, id), (None, ()))
+        for key in entry_keys:
+            i = bisect.bisect_left(self._entries, (key, kind, id, name))
+            if i < len(self._entries) and self._entries[i] == (key, kind, id, name):
+                del self._entries[i]
+
+    def lookup(self, prefix, limit=10, kind=None):
+        """Up to `limit` {type, id, name} dicts whose name has a word starting with `prefix`."""
+        prefix = normalize(prefix)[:MAX_KEY_LENGTH]
+        if not prefix:
+            return []
+        self._ensure_built()
+        results = []
+        seen = set()
+        with self._lock:
+            entries = self._entries
+            i = bisect.bisect_left(entries, (prefix,))
+            while i < len(entries) and len(results) < limit:
+                key, entry_kind, id, name = entries[i]
+                if not key.startswith(prefix):
+                    break
+                if (entry_kind, id) not in seen and (kind is None or kind == entry_kind):
+                    seen.add((entry_kind, id))
+                    results.append({'type': entry_kind, 'id': id, 'name': name})
+                i += 1
+        return results